@@ -1,26 +1,105 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Category, Item, PendingCategory
+from . import events, notifications
+from .images import schedule_variants
+from .models import Category, Item, Job, Notification, PendingCategory
+
+def _normalize_category_name(name):
+    """Collapse whitespace and case so that "Phone", "phone " and "PHONE" compare equal."""
+    return ' '.join(name.split()).casefold()
+
+def _approve_pending_categories(modeladmin, request, queryset, merge_variants):
+    """
+    Turn pending categories into categories and move their items over with
+    one UPDATE per category, all in a single transaction. With
+    ``merge_variants``, pending names (and pending categories) that only
+    differ in case or spacing from a selected one are folded into it.
+    """
+    with transaction.atomic():
+        selected = list(queryset)
+        groups = {}  # category name -> Q matching the items that move to it
+        pending_ids = {pending.pk for pending in selected}
+
+        if merge_variants:
+            canonical = {}
+            for pending in selected:
+                canonical.setdefault(_normalize_category_name(pending.name), ' '.join(pending.name.split()))
+            for pending in PendingCategory.objects.all():
+                if _normalize_category_name(pending.name) in canonical:
+                    pending_ids.add(pending.pk)
+            variants = {key: set() for key in canonical}
+            pending_names = (
+                Item.objects.filter(pending_category_name__isnull=False)
+                .values_list('pending_category_name', flat=True)
+                .distinct()
+            )
+            for name in pending_names:
+                key = _normalize_category_name(name)
+                if key in variants:
+                    variants[key].add(name)
+            existing = {_normalize_category_name(category.name): category for category in Category.objects.all()}
+            for key, name in canonical.items():
+                name = existing[key].name if key in existing else name
+                groups[name] = Q(pending_category_name__in=variants[key])
+        else:
+            for pending in selected:
+                groups[pending.name] = Q(pending_category_name__iexact=pending.name)
+
+        categories = {category.name: category for category in Category.objects.filter(name__in=groups)}
+        moved_ids = []
+        for name, items in groups.items():
+            category = categories.get(name) or Category.objects.create(name=name)
+            item_ids = list(Item.objects.filter(items).values_list('pk', flat=True))
+            # The searchable text is unchanged (same name up to case and spacing), so no reindex is needed
+            Item.objects.filter(pk__in=item_ids).touch(category=category, pending_category_name=None)
+            moved_ids += item_ids
+
+        PendingCategory.objects.filter(pk__in=pending_ids).delete()
+        # touch() skips the post_save receiver that tells open pages about the change
+        events.publish_items('updated', moved_ids)
+        updated = len(moved_ids)
+
+    modeladmin.message_user(
+        request,
+        f'Approved {len(groups)} categories and moved {updated} items into them.',
+        messages.SUCCESS,
+    )
 
 @admin.action(description='Approve selected pending categories')
 def approve_categories(modeladmin, request, queryset):
-    for pending_category in queryset:
-        # Create a new Category
-        category, created = Category.objects.get_or_create(name=pending_category.name)
-        
-        # Find and update items with the pending category name
-        items_to_update = Item.objects.filter(pending_category_name__iexact=pending_category.name)
-        for item in items_to_update:
-            item.category = category
-            item.pending_category_name = None # Clear the pending name
-            item.save()
-            
-        # Delete the pending category
-        pending_category.delete()
+    _approve_pending_categories(modeladmin, request, queryset, merge_variants=False)
+
+@admin.action(description='Approve selected pending categories, merging case and spacing variants')
+def approve_and_merge_categories(modeladmin, request, queryset):
+    _approve_pending_categories(modeladmin, request, queryset, merge_variants=True)
 
 class PendingCategoryAdmin(admin.ModelAdmin):
     list_display = ('name',)
-    actions = [approve_categories]
+    actions = [approve_categories, approve_and_merge_categories]
+
+def _set_item_status(modeladmin, request, queryset, status):
+    """Change the status of the selected items with one UPDATE and notify their watchers afterwards."""
+    with transaction.atomic():
+        previous_status = dict(queryset.exclude(status=status).values_list('pk', 'status'))
+        updated = Item.objects.filter(pk__in=previous_status).touch(status=status)
+        notifications.status_changed(list(previous_status))
+        events.publish_items('status_changed', previous_status, previous_status)
+    modeladmin.message_user(
+        request,
+        f'Marked {updated} items as "{dict(Item.STATUS_CHOICES)[status]}".',
+        messages.SUCCESS,
+    )
+
+@admin.action(description='Mark selected items as at the Prefect Office')
+def mark_at_repository(modeladmin, request, queryset):
+    _set_item_status(modeladmin, request, queryset, 'at_repository')
+
+@admin.action(description='Mark selected items as retrieved')
+def mark_retrieved(modeladmin, request, queryset):
+    _set_item_status(modeladmin, request, queryset, 'retrieved')
 
 class ItemAdmin(admin.ModelAdmin):
     list_display = ('name', 'category', 'status', 'get_holding_users', 'found_date', 'pub_date', 'uploaded_by', 'display_image')
@@ -29,6 +108,18 @@ class ItemAdmin(admin.ModelAdmin):
     search_fields = ('name', 'description')
     readonly_fields = ('get_holding_users', 'display_image')
     autocomplete_fields = ('retrieved_by',)
+    actions = [mark_at_repository, mark_retrieved]
+
+    def get_queryset(self, request):
+        # Load the holding users of the whole changelist page in one query
+        return super().get_queryset(request).prefetch_related('held_by')
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            obj.image_variants = {}
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_variants(obj)
 
     def get_holding_users(self, obj):
         return ", ".join([user.username for user in obj.held_by.all()])
@@ -36,10 +127,31 @@ class ItemAdmin(admin.ModelAdmin):
 
     def display_image(self, obj):
         if obj.image:
-            return format_html('<img src="{}" width="100" />', obj.image.url)
+            return format_html('<img src="{}" width="100" />', obj.thumbnail_url)
         return "No Image"
     display_image.short_description = 'Image'
 
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'item', 'status', 'created_at', 'read_at')
+    list_filter = ('status', 'read_at')
+    list_select_related = ('user', 'item')
+    raw_id_fields = ('user', 'item')
+
+@admin.action(description='Run selected jobs again')
+def retry_jobs(modeladmin, request, queryset):
+    queued = queryset.exclude(status='running').update(
+        status='queued', attempts=0, run_after=timezone.now(), locked_by='', finished_at=None,
+    )
+    modeladmin.message_user(request, f'Queued {queued} jobs again.', messages.SUCCESS)
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'priority', 'attempts', 'run_after', 'created_at', 'finished_at')
+    list_filter = ('status', 'task')
+    readonly_fields = ('locked_by', 'locked_at', 'last_error', 'created_at', 'finished_at')
+    actions = [retry_jobs]
+
 admin.site.register(Category)
 admin.site.register(Item, ItemAdmin)
-admin.site.register(PendingCategory, PendingCategoryAdmin)
\ No newline at end of file
+admin.site.register(PendingCategory, PendingCategoryAdmin)
+admin.site.register(Notification, NotificationAdmin)
+admin.site.register(Job, JobAdmin)
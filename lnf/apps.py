@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LnfConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lnf'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the model signal receivers)
@@ -0,0 +1,101 @@
+"""
+Shared caching and HTTP validators for item list responses.
+
+Cached entries embed the current "items generation", a counter kept in the
+cache backend and bumped on every Item or Category write. Bumping it makes
+all earlier entries unreachable at once, so nothing has to be deleted
+explicitly. With several worker processes the cache must be shared (file or
+Redis, see LNF_CACHE_BACKEND) for the counter to be shared too.
+
+The same counter, the time of the last write and a per-user watch version
+make up the watermark behind the ETag and Last-Modified headers of the item
+views, which lets them answer 304 without touching the database.
+"""
+import datetime
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+
+GENERATION_KEY = 'lnf:items:generation'
+LAST_MODIFIED_KEY = 'lnf:items:last_modified'
+WATCH_VERSION_KEY = 'lnf:watch:{user_id}'
+ITEMS_CACHE_TIMEOUT = getattr(settings, 'LNF_ITEMS_CACHE_TIMEOUT', 300)
+
+
+def items_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so that a counter lost to eviction or a restart
+        # never comes back with a value that earlier entries were stored under.
+        cache.add(GENERATION_KEY, time.time_ns() // 1000, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_items_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        items_generation()
+    cache.set(LAST_MODIFIED_KEY, _now_us(), None)
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def _get_or_seed(key):
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _now_us(), None)
+        value = cache.get(key)
+    return value
+
+
+def user_watch_version(user):
+    """A timestamp (in microseconds) of the last watch list change of ``user``."""
+    if not user.is_authenticated:
+        return 0
+    return _get_or_seed(WATCH_VERSION_KEY.format(user_id=user.pk))
+
+
+def bump_user_watch_version(user_id):
+    cache.set(WATCH_VERSION_KEY.format(user_id=user_id), _now_us(), None)
+
+
+def items_etag(request, *args, **kwargs):
+    """
+    ETag of an item list view. It covers the request parameters, the user and
+    the watermark, so it changes whenever the rendered list could change.
+    """
+    if messages.get_messages(request):
+        # Pending flash messages are shown (and consumed) by a full render
+        return None
+    params = sorted((key, value) for key, value in request.GET.lists() if key != '_')
+    user_id = request.user.pk if request.user.is_authenticated else None
+    raw = json.dumps([request.path, params, user_id, items_generation(), user_watch_version(request.user)])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def items_last_modified(request, *args, **kwargs):
+    timestamp = max(_get_or_seed(LAST_MODIFIED_KEY), user_watch_version(request.user))
+    return datetime.datetime.fromtimestamp(timestamp / 1_000_000, tz=datetime.timezone.utc)
+
+
+def filter_signature(form, **extra):
+    """A stable digest of the cleaned filter form plus any extra request parameters."""
+    data = dict(form.cleaned_data)
+    data['q'] = (data.get('q') or '').strip().lower()
+    data['categories'] = sorted(data.get('categories') or [])
+    data['found_date'] = data['found_date'].isoformat() if data.get('found_date') else None
+    data.update(extra)
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def items_response_key(signature):
+    return f'lnf:items_api:{items_generation()}:{signature}'
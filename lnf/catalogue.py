@@ -0,0 +1,97 @@
+"""
+Process-local copy of the category catalogue.
+
+Categories change rarely (when an admin approves or edits one) but are
+needed by every item list request and upload. Each worker process keeps the
+whole catalogue in memory and rebuilds it when the version stored in the
+shared cache no longer matches its copy. The version is bumped after every
+committed Category or PendingCategory write (see lnf.signals).
+"""
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+
+VERSION_KEY = 'lnf:catalogue:version'
+
+CatalogueEntry = namedtuple('CatalogueEntry', 'id name parent_id path depth')
+
+
+class Catalogue:
+    def __init__(self, categories, pending_names):
+        self.by_id = {}
+        self.id_by_lower = {}
+        self.children = {}
+        for category in categories:
+            entry = CatalogueEntry(
+                category['id'], category['name'], category['parent_id'], category['path'],
+                category['path'].count('/') - 2,
+            )
+            self.by_id[entry.id] = entry
+            self.id_by_lower[entry.name.lower()] = entry.id
+            self.children.setdefault(entry.parent_id, []).append(entry)
+        for siblings in self.children.values():
+            siblings.sort(key=lambda entry: entry.name.lower())
+        self.pending_by_lower = {name.lower(): name for name in pending_names}
+
+        # Depth-first, siblings by name
+        self.tree = []
+        stack = list(reversed(self.children.get(None, [])))
+        while stack:
+            entry = stack.pop()
+            self.tree.append(entry)
+            stack.extend(reversed(self.children.get(entry.id, [])))
+
+    def choices(self):
+        return [(entry.id, '— ' * entry.depth + entry.name) for entry in self.tree]
+
+    def sorted_by_name(self):
+        return sorted(self.by_id.values(), key=lambda entry: entry.name.lower())
+
+    def descendant_ids(self, category_ids):
+        """The given categories and everything below them."""
+        result = set()
+        stack = [pk for pk in category_ids if pk in self.by_id]
+        while stack:
+            pk = stack.pop()
+            if pk not in result:
+                result.add(pk)
+                stack.extend(child.id for child in self.children.get(pk, []))
+        return result
+
+
+_lock = threading.Lock()
+_loaded = {'version': None, 'catalogue': None}
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns() // 1000, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _load():
+    from .models import Category, PendingCategory
+    from .routers import primary_reads
+
+    with primary_reads():
+        categories = list(Category.objects.values('id', 'name', 'parent_id', 'path'))
+        pending_names = list(PendingCategory.objects.values_list('name', flat=True))
+    return Catalogue(categories, pending_names)
+
+
+def get_catalogue():
+    version = _current_version()
+    if _loaded['version'] != version:
+        with _lock:
+            if _loaded['version'] != version:
+                _loaded['catalogue'] = _load()
+                _loaded['version'] = version
+    return _loaded['catalogue']
+
+
+def bump_catalogue_version():
+    cache.set(VERSION_KEY, time.time_ns() // 1000, None)
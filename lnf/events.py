@@ -0,0 +1,164 @@
+"""
+In-process pub/sub of item changes, streamed to browsers as server-sent events.
+
+Model signals publish an event once the write is committed. Every open
+``/api/items/events/`` connection holds a bounded asyncio queue that is fed
+thread-safely from whichever thread committed the write. The last events are
+kept so a reconnecting browser (which sends ``Last-Event-ID``) does not miss
+any. The broker lives in the process: when the site runs several worker
+processes, each one only streams the writes it handled itself, so run the
+ASGI server with a single worker process (and as many threads as needed).
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import Item
+from .serializers import display_date
+
+# Events kept for browsers that reconnect
+REPLAY_SIZE = 200
+# A subscriber that falls this far behind is dropped; its browser reconnects
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # None tells the stream to close; the browser resumes from its Last-Event-ID
+            self.broker.unsubscribe(self)
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Time-seeded, so ids held by browsers stay comparable after a restart
+        self._ids = itertools.count(time.time_ns() // 1000)
+        self._recent = deque(maxlen=REPLAY_SIZE)
+        self._subscriptions = set()
+
+    def subscribe(self):
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def replay(self, last_event_id):
+        """Events published after ``last_event_id`` that are still kept."""
+        with self._lock:
+            return [event for event in self._recent if event['id'] > last_event_id]
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'data': data}
+            self._recent.append(event)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # The loop of a finished server thread
+                self.unsubscribe(subscription)
+        return event
+
+
+broker = Broker()
+
+
+def streaming_supported(request):
+    """
+    Whether ``request`` came through the ASGI application. Under WSGI (runserver,
+    gunicorn sync workers) Django buffers an async stream into a list before
+    sending any of it, so an endless stream would hold a worker and send nothing.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def format_event(event):
+    data = json.dumps(event['data'], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+def item_payload(item):
+    """The user-independent fields of an item row, as the page renders them."""
+    if item.category_id is not None:
+        category = {'name': item.category.name, 'pending': False}
+    else:
+        category = {'name': item.pending_category_name or '', 'pending': True}
+    return {
+        'id': item.pk,
+        'name': item.name,
+        'category': category,
+        'found_date': item.found_date,
+        'found_on': display_date(item.found_date),
+        'location': item.found_location,
+        'status': item.status,
+        'version': item.version,
+    }
+
+
+def publish_items(event_type, item_ids, previous_status=None):
+    """
+    Publish ``event_type`` for each of ``item_ids`` once the transaction commits,
+    for bulk writes (ItemQuerySet.touch()) that the post_save receivers don't see.
+    ``previous_status`` maps item ids to their status before a status change.
+    """
+    item_ids = list(item_ids)
+
+    def publish():
+        items = Item.objects.filter(pk__in=item_ids).select_related('category').order_by('pk')
+        for item in items.iterator(chunk_size=500):
+            payload = item_payload(item)
+            if previous_status is not None:
+                payload['previous_status'] = previous_status[item.pk]
+            broker.publish(event_type, payload)
+
+    if item_ids:
+        transaction.on_commit(publish)
+
+
+async def stream(last_event_id=0):
+    """Yield the SSE stream for one connection, starting after ``last_event_id``."""
+    subscription = broker.subscribe()
+    try:
+        yield 'retry: 3000\n\n'
+        for event in broker.replay(last_event_id):
+            last_event_id = event['id']
+            yield format_event(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if event is None:
+                break
+            # Already sent while replaying
+            if event['id'] > last_event_id:
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
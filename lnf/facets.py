@@ -0,0 +1,90 @@
+"""
+Facet counts for the item filter sidebar.
+
+All counts come from one grouped query over the items matching the search
+and date filters, grouped by category, status and found-date bucket. Each
+facet is then summed in Python with every *other* active filter applied, so
+a count tells how many items ticking that option would show. Results are
+cached per filter signature and items generation.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Value, When
+from django.utils import timezone
+
+from .caching import ITEMS_CACHE_TIMEOUT, filter_signature, items_generation
+from .catalogue import get_catalogue
+from .models import Item
+from .routers import primary_reads
+from .search import search_items
+
+# (bucket, found within this many days), checked in order; anything older is 'older'
+DATE_BUCKETS = (('today', 0), ('week', 6), ('month', 29))
+
+
+def _date_bucket(today):
+    return Case(
+        *[When(found_date__gte=today - datetime.timedelta(days=days), then=Value(bucket))
+          for bucket, days in DATE_BUCKETS],
+        default=Value('older'),
+        output_field=CharField(),
+    )
+
+
+def _grouped_counts(cleaned_data):
+    items = Item.objects.all()
+    if cleaned_data.get('found_date'):
+        items = items.filter(found_date=cleaned_data['found_date'])
+    if cleaned_data.get('q'):
+        items = search_items(items, cleaned_data['q'])
+    return (
+        items.annotate(bucket=_date_bucket(timezone.localdate()))
+        .values('category_id', 'status', 'bucket')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+
+def compute_facets(form):
+    """Per-category, per-status and per-date-bucket counts for a valid ItemFilterForm."""
+    cleaned_data = form.cleaned_data
+    catalogue = get_catalogue()
+    selected = catalogue.descendant_ids(cleaned_data['categories']) if cleaned_data.get('categories') else None
+    include_retrieved = cleaned_data.get('include_retrieved')
+
+    categories, statuses, dates = {}, {}, {}
+    for row in _grouped_counts(cleaned_data):
+        count = row['count']
+        status_passes = include_retrieved or row['status'] != 'retrieved'
+        category_passes = selected is None or row['category_id'] in selected
+
+        if status_passes:
+            # A category counts the items of its whole subtree, like the filter itself
+            category_id = row['category_id']
+            if category_id is None:
+                categories['pending'] = categories.get('pending', 0) + count
+            while category_id is not None and category_id in catalogue.by_id:
+                categories[category_id] = categories.get(category_id, 0) + count
+                category_id = catalogue.by_id[category_id].parent_id
+        if category_passes:
+            statuses[row['status']] = statuses.get(row['status'], 0) + count
+        if status_passes and category_passes:
+            dates[row['bucket']] = dates.get(row['bucket'], 0) + count
+
+    return {
+        'categories': {str(key): value for key, value in categories.items()},
+        'status': statuses,
+        'found_date': dates,
+        'total': sum(dates.values()),
+    }
+
+
+def get_facets(form):
+    key = f'lnf:facets:{items_generation()}:{filter_signature(form, sort_by=None)}'
+    facets = cache.get(key)
+    if facets is None:
+        with primary_reads():
+            facets = compute_facets(form)
+        cache.set(key, facets, ITEMS_CACHE_TIMEOUT)
+    return facets
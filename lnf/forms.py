@@ -1,7 +1,8 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.core.exceptions import ValidationError
-from .models import Category, Item
+from .catalogue import get_catalogue
+from .models import Item
 
 
 class LoginForm(AuthenticationForm):
@@ -80,8 +81,9 @@ class ItemFilterForm(forms.Form):
         label='Search',
         widget=forms.TextInput(attrs={'placeholder': 'Item name or location...'})
     )
-    categories = forms.ModelMultipleChoiceField(
-        queryset=Category.objects.all().order_by('name'),
+    # Choices come from the in-memory category catalogue, see __init__
+    categories = forms.TypedMultipleChoiceField(
+        coerce=int,
         required=False,
         widget=forms.CheckboxSelectMultiple(attrs={'class': 'checkbox-inline'}),
         label='Categories'
@@ -93,6 +95,7 @@ class ItemFilterForm(forms.Form):
     )
     sort_by = forms.ChoiceField(
         choices=(
+            ('relevance', 'Best Match'),
             ('-found_date', 'Date Found (Newest First)'),
             ('found_date', 'Date Found (Oldest First)'),
             ('-pub_date', 'Date Published (Newest First)'),
@@ -104,3 +107,8 @@ class ItemFilterForm(forms.Form):
         label='Sort by'
     )
     include_retrieved = forms.BooleanField(required=False, label='Show Retrieved Items')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Categories in tree order, subcategories indented
+        self.fields['categories'].choices = get_catalogue().choices()
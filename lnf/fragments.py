@@ -0,0 +1,70 @@
+"""
+Cached rendering of item rows.
+
+Each row is split in two: the user-independent part (``_item_row.html``) is
+cached per item, view mode and ``Item.version``, so any save of the item
+yields a new key; the user-specific part (watch class and action buttons) is
+patched into the cached markup for every request. Actions only depend on the
+item through its id, so each action variant is rendered once per request
+with a placeholder id and the real id is substituted per row.
+"""
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Bump when _item_row.html changes so stale fragments are not served
+ROW_TEMPLATE_VERSION = 3
+ROW_CACHE_TIMEOUT = 60 * 60 * 24
+
+WATCH_CLASS_MARKER = '__lnf_watch_class__'
+ACTIONS_MARKER = '__lnf_item_actions__'
+# Placeholder id used to render action variants; it only ever appears in our own markup
+PLACEHOLDER_ITEM_ID = 987654321987654321
+
+
+def _row_key(item, view_type, show_image):
+    return f'lnf:row:{ROW_TEMPLATE_VERSION}:{view_type}:{int(show_image)}:{item.pk}:{item.version}'
+
+
+def render_item_rows(items, view_type, request, show_delete_button=False, on_profile_page=False):
+    """Render the rows of ``items`` for ``request.user``, reusing cached fragments."""
+    view_type = 'list' if view_type == 'list' else 'grid'
+    user = request.user
+
+    rows = []
+    for item in items:
+        is_owner = user.is_authenticated and item.uploaded_by_id == user.pk
+        show_image = view_type == 'grid' and on_profile_page and is_owner and bool(item.image)
+        rows.append((item, is_owner, _row_key(item, view_type, show_image), show_image))
+
+    fragments = cache.get_many([key for _, _, key, _ in rows])
+    missing = {}
+    for item, _, key, show_image in rows:
+        if key not in fragments:
+            missing[key] = render_to_string(
+                'lnf/partials/_item_row.html',
+                {'item': item, 'view_type': view_type, 'show_image': show_image},
+            )
+    if missing:
+        cache.set_many(missing, ROW_CACHE_TIMEOUT)
+        fragments.update(missing)
+
+    placeholder = str(PLACEHOLDER_ITEM_ID)
+    actions = {}
+    html = []
+    for item, is_owner, key, _ in rows:
+        is_watched = bool(getattr(item, 'is_held_by_user', False))
+        variant = (is_owner, item.status == 'retrieved', is_watched)
+        if variant not in actions:
+            actions[variant] = render_to_string('lnf/partials/_item_actions.html', {
+                'item_id': PLACEHOLDER_ITEM_ID,
+                'is_owner': is_owner,
+                'is_retrieved': item.status == 'retrieved',
+                'is_watched': is_watched,
+                'show_delete_button': show_delete_button,
+            }, request=request)
+        # The watch class comes before any item text, the actions after all of it
+        row = fragments[key].replace(WATCH_CLASS_MARKER, 'is-watched' if is_watched else '', 1)
+        head, _, tail = row.rpartition(ACTIONS_MARKER)
+        html.append(head + actions[variant].replace(placeholder, str(item.pk)) + tail)
+    return mark_safe(''.join(html))
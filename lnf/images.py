@@ -0,0 +1,72 @@
+"""
+Resized variants of uploaded item images.
+
+After an item with an image is saved, a background job (see lnf.jobs)
+writes a few fixed-width JPEG and WebP copies next to the original and
+records their storage names in ``Item.image_variants``. Templates build
+``srcset`` from those names and keep using the original until the variants
+exist.
+"""
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+}
+# Ahead of routine jobs: the grid shows the full-size original until these exist
+JOB_PRIORITY = 10
+
+
+def variant_name(name, width, fmt):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'variants', f'{stem}-{width}w{VARIANT_FORMATS[fmt][1]}')
+
+
+def _encode(image, fmt):
+    pil_format, _, options = VARIANT_FORMATS[fmt]
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(item_id):
+    """Write the resized copies of an item's image and record them on the item."""
+    from .models import Item
+
+    item = Item.objects.filter(pk=item_id).only('image').first()
+    if item is None or not item.image:
+        return
+    storage = item.image.storage
+    source_name = item.image.name
+
+    with storage.open(source_name, 'rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    variants = {fmt: {} for fmt in VARIANT_FORMATS}
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] or [image.width]
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for fmt in VARIANT_FORMATS:
+            name = variant_name(source_name, width, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            variants[fmt][str(width)] = storage.save(name, _encode(resized, fmt))
+
+    # Only record the variants if the image was not replaced in the meantime
+    Item.objects.filter(pk=item_id, image=source_name).touch(image_variants=variants)
+
+
+def schedule_variants(item):
+    """Queue the generation of the image variants of ``item``; it runs if the save commits."""
+    from .jobs import enqueue
+
+    if item.image:
+        enqueue('lnf.images.generate_variants', priority=JOB_PRIORITY, item_id=item.pk)
@@ -0,0 +1,184 @@
+"""
+A small job queue kept in the database.
+
+``enqueue()`` adds a Job row in the caller's transaction, so work is only
+queued if the write that asked for it commits, and survives restarts.
+``manage.py runworkers`` runs a pool of threads that claim jobs with a
+conditional UPDATE: queued rows are switched to running under a fresh claim
+token only while they are still queued, so two workers never claim the same
+job and no database row locks are needed. Failed jobs are retried with exponential
+backoff until ``max_attempts``; jobs of a worker that died are queued again
+once their lease has run out, unless that was their last attempt.
+
+A task is any importable function taking keyword arguments that JSON can
+hold, referenced by its dotted path. Jobs run at least once: one whose
+result could not be recorded runs again after its lease, so tasks should be
+safe to repeat.
+"""
+import datetime
+import logging
+import random
+import threading
+import traceback
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+from .sqlite import serialized_write
+
+logger = logging.getLogger(__name__)
+
+# A running job whose worker has not finished it after this long is run again
+LEASE_SECONDS = getattr(settings, 'LNF_JOB_LEASE_SECONDS', 600)
+RETRY_BASE_SECONDS = getattr(settings, 'LNF_JOB_RETRY_BASE_SECONDS', 10)
+RETRY_MAX_SECONDS = 60 * 60
+# Finished jobs are deleted after this long
+KEEP_FINISHED_DAYS = getattr(settings, 'LNF_JOB_KEEP_FINISHED_DAYS', 7)
+
+
+def enqueue(task, priority=0, delay=None, max_attempts=5, **kwargs):
+    """Queue ``task`` (a dotted path) to be called with ``kwargs``; higher priorities run first."""
+    import_string(task)  # Fail now rather than in the worker
+    return Job.objects.create(
+        task=task,
+        kwargs=kwargs,
+        priority=priority,
+        run_after=timezone.now() + (delay or datetime.timedelta()),
+        max_attempts=max_attempts,
+    )
+
+
+@serialized_write()
+def claim(limit=1):
+    """Mark up to ``limit`` due jobs as running under a new claim token and return them."""
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(status='queued', run_after__lte=now)
+        .order_by('-priority', 'run_after', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not candidates:
+        return []
+    token = uuid.uuid4().hex
+    # Jobs another worker claimed in between are no longer queued and stay out
+    claimed = Job.objects.filter(pk__in=candidates, status='queued').update(
+        status='running', locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return []
+    return list(Job.objects.filter(locked_by=token).order_by('-priority', 'run_after', 'id'))
+
+
+def retry_delay(attempts):
+    """Seconds to wait before another attempt, doubling per attempt with some jitter."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.75, 1.25)
+
+
+def run(job):
+    """Run a claimed job and record how it went; return whether it succeeded."""
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    try:
+        import_string(job.task)(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts >= job.max_attempts:
+            logger.error('Job %s failed for good after %s attempts', job, job.attempts)
+            mine.update(status='failed', locked_by='', finished_at=now, last_error=error)
+        else:
+            logger.warning('Job %s failed, retrying', job, exc_info=True)
+            run_after = now + datetime.timedelta(seconds=retry_delay(job.attempts))
+            mine.update(status='queued', locked_by='', run_after=run_after, last_error=error)
+        return False
+    mine.update(status='done', locked_by='', finished_at=timezone.now())
+    return True
+
+
+def requeue_stale():
+    """
+    Queue the running jobs whose lease ran out again, their worker being gone,
+    or fail them if that was their last attempt. Return how many were queued.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - datetime.timedelta(seconds=LEASE_SECONDS))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_by='', finished_at=now,
+        last_error=f'The lease ran out after {LEASE_SECONDS} seconds on the last attempt; the worker was lost.',
+    )
+    if failed:
+        logger.error('%s jobs failed for good: their worker was lost on their last attempt', failed)
+    return stale.update(status='queued', locked_by='')
+
+
+def prune_finished():
+    cutoff = timezone.now() - datetime.timedelta(days=KEEP_FINISHED_DAYS)
+    return Job.objects.filter(status__in=('done', 'failed'), finished_at__lt=cutoff).delete()[0]
+
+
+class WorkerPool:
+    """``concurrency`` threads claiming and running jobs until stopped."""
+
+    def __init__(self, concurrency=1, poll_interval=1.0, burst=False):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        # In burst mode a thread exits as soon as it finds nothing to do
+        self.burst = burst
+        self.stopping = threading.Event()
+        self.processed = 0
+        self._count_lock = threading.Lock()
+
+    def run(self, maintenance_interval=60):
+        threads = [
+            threading.Thread(target=self._work, name=f'lnf-worker-{number}', daemon=True)
+            for number in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                self._maintain()
+                for thread in threads:
+                    thread.join(timeout=maintenance_interval / len(threads))
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            close_old_connections()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _maintain(self):
+        try:
+            requeue_stale()
+            prune_finished()
+        except Exception:
+            logger.exception('Job queue maintenance failed')
+        finally:
+            close_old_connections()
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                jobs = claim()
+                for job in jobs:
+                    run(job)
+            except Exception:
+                # Database trouble: back off and try again
+                logger.exception('Could not claim or finish a job')
+                jobs = None
+            finally:
+                close_old_connections()
+            if jobs:
+                with self._count_lock:
+                    self.processed += len(jobs)
+            elif self.burst and jobs is not None:
+                return
+            else:
+                self.stopping.wait(self.poll_interval)
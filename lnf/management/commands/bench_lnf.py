@@ -0,0 +1,226 @@
+import io
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from lnf.forms import ItemFilterForm
+from lnf.models import Category, Item
+from lnf.serializers import FIELDS
+
+from .seed_lnf import USERNAME_PREFIX
+
+DEFAULT_SIZES = '1000,10000,100000'
+# Statuses a scenario may answer with; anything else means the benchmark is broken
+OK_STATUSES = {200, 302}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of ``samples``."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def tiny_image():
+    content = io.BytesIO()
+    Image.new('RGB', (64, 48), 'navy').save(content, 'PNG')
+    return content.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the main views against generated data (see seed_lnf) at several sizes and report "
+        "p50/p95 latency and query counts. Runs in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated item counts to test at.")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per scenario.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the generated data.")
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help="Keep the cache between requests instead of clearing it before each one.",
+        )
+        parser.add_argument('--only', help="Only run the scenarios whose name contains this text.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--compare', help="A JSON file from an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of numbers.")
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+
+        self.options = options
+        # The request metrics would log every slow request the benchmark makes
+        metrics_logger = logging.getLogger('lnf.metrics')
+        was_disabled = metrics_logger.disabled
+        metrics_logger.disabled = True
+        try:
+            self.run_benchmark(sizes, baseline)
+        finally:
+            metrics_logger.disabled = was_disabled
+
+    def run_benchmark(self, sizes, baseline):
+        options = self.options
+        database = connection.vendor
+        if database == 'sqlite':
+            database += f' {connection.Database.sqlite_version}'
+        report = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': database,
+            'repeat': options['repeat'],
+            'warm_cache': options['warm_cache'],
+            'results': {},
+        }
+        for size in sizes:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{size} items"))
+            results = self.run_size(size)
+            report['results'][str(size)] = results
+            self.write_results(results, (baseline or {}).get('results', {}).get(str(size)))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+    def run_size(self, size):
+        """Seed a fresh test database with ``size`` items and run every scenario against it."""
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # A private cache, so clearing it leaves the real one alone; media files go to a temporary directory
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lnf-bench'}}
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(CACHES=caches, MEDIA_ROOT=media_root):
+                started = time.perf_counter()
+                call_command(
+                    'seed_lnf', items=size, users=max(50, size // 100), categories=30,
+                    seed=self.options['seed'], stdout=io.StringIO(),
+                )
+                self.stdout.write(f"  seeded in {time.perf_counter() - started:.1f}s")
+                return {name: self.measure(request) for name, request in self.scenarios()}
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def scenarios(self):
+        """(name, request) pairs; a request is a function making one request and returning the response."""
+        user = User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk').first()
+        # A typical signed-in user watches a handful of items
+        user.held_items.add(*Item.objects.exclude(status='retrieved').order_by('pk')[:10])
+        admin = User.objects.create_superuser('bench-admin', 'bench-admin@example.com', None)
+        anonymous, signed_in, staff = Client(), Client(), Client()
+        signed_in.force_login(user)
+        staff.force_login(admin)
+
+        items_api = reverse('lnf:items_api')
+        category = Category.objects.filter(parent__isnull=True).order_by('pk').first()
+        today = timezone.localdate().isoformat()
+        filters = [
+            ('with retrieved', {'include_retrieved': 'on'}),
+            ('category', {'categories': category.pk}),
+            ('found date', {'found_date': today}),
+            ('search', {'q': 'leather wallet'}),
+            ('fuzzy search', {'q': 'walet'}),
+        ]
+        sorts = [value for value, _ in ItemFilterForm.base_fields['sort_by'].choices]
+        watch_url = reverse('lnf:toggle_watch_item', args=[Item.objects.order_by('-pk').values_list('pk', flat=True)[0]])
+        image = tiny_image()
+
+        scenarios = [
+            ('index anonymous', lambda: anonymous.get(reverse('lnf:index'))),
+            ('index', lambda: signed_in.get(reverse('lnf:index'))),
+            ('items_api anonymous', lambda: anonymous.get(items_api)),
+        ]
+        for sort_by in sorts:
+            scenarios.append((f'items_api sort={sort_by}', lambda sort_by=sort_by: signed_in.get(items_api, {'sort_by': sort_by})))
+        for label, params in filters:
+            scenarios.append((f'items_api {label}', lambda params=params: signed_in.get(items_api, params)))
+        scenarios += [
+            ('items_api json', lambda: signed_in.get(items_api, {'format': 'json', 'fields': ','.join(FIELDS)})),
+            ('items_api facets', lambda: signed_in.get(items_api, {'facets': '1'})),
+            # Watches and unwatches the same item in turn
+            ('toggle_watch_item', lambda: signed_in.post(watch_url)),
+            ('profile', lambda: signed_in.get(reverse('lnf:profile'))),
+            ('upload', lambda: signed_in.post(reverse('lnf:upload'), {
+                'name': 'Blue canvas umbrella',
+                'description': 'Found under a bench.',
+                'found_location': 'Canteen',
+                'found_date': today,
+                'category_name': category.name,
+                'image': SimpleUploadedFile('umbrella.png', image, content_type='image/png'),
+            })),
+            ('admin changelist', lambda: staff.get(reverse('admin:lnf_item_changelist'))),
+        ]
+        only = self.options['only']
+        return [(name, request) for name, request in scenarios if not only or only in name]
+
+    def measure(self, request):
+        timings, queries = [], []
+        # One untimed round, so template loading and the like don't count
+        self.check_response(request())
+        for _ in range(self.options['repeat']):
+            if not self.options['warm_cache']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                elapsed = time.perf_counter() - started
+            self.check_response(response)
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': percentile(queries, 0.5),
+        }
+
+    def check_response(self, response):
+        if response.status_code not in OK_STATUSES:
+            raise CommandError(f"{response.request['PATH_INFO']} answered {response.status_code}.")
+
+    def write_results(self, results, baseline=None):
+        self.stdout.write(f"  {'scenario':<32} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8}")
+        for name, result in results.items():
+            line = f"  {name:<32} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['queries']:>8}"
+            before = (baseline or {}).get(name)
+            if before:
+                change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+                line += f"   p50 {change:+.0f}%, queries {result['queries'] - before['queries']:+d}"
+            self.stdout.write(line)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from lnf.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for all items."
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,27 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from lnf.jobs import WorkerPool
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help="Number of worker threads.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--burst', action='store_true', help="Exit once there are no due jobs left.")
+
+    def handle(self, *args, **options):
+        pool = WorkerPool(
+            concurrency=max(1, options['concurrency']),
+            poll_interval=options['poll_interval'],
+            burst=options['burst'],
+        )
+        # Let running jobs finish on Ctrl-C or a stop from the process manager
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: pool.stop())
+        self.stdout.write(f"Running jobs with {pool.concurrency} workers.")
+        pool.run()
+        self.stdout.write(self.style.SUCCESS(f"Stopped after {pool.processed} jobs."))
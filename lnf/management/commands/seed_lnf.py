@@ -0,0 +1,165 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from lnf.caching import bump_items_generation
+from lnf.catalogue import bump_catalogue_version
+from lnf.models import Category, Item, PendingCategory, next_change_seq
+from lnf.search import rebuild_index
+
+USERNAME_PREFIX = 'seed-user-'
+
+CATEGORY_NAMES = [
+    'Bags', 'Backpacks', 'Pouches', 'Electronics', 'Phones', 'Chargers', 'Earphones', 'Calculators',
+    'Clothing', 'Jackets', 'Uniforms', 'Caps', 'Accessories', 'Watches', 'Eyeglasses', 'Jewelry',
+    'School Supplies', 'Notebooks', 'Pens', 'Books', 'Lunch Boxes', 'Tumblers', 'Umbrellas',
+    'Wallets', 'IDs', 'Keys', 'Sports Equipment', 'Balls', 'Rackets', 'Shoes',
+]
+PENDING_NAMES = ['Toys', 'Musical Instruments', 'Art Materials', 'Medicine', 'Cosmetics', 'Flash Drives']
+COLOURS = ['black', 'white', 'blue', 'red', 'green', 'grey', 'pink', 'brown', 'navy', 'yellow']
+MATERIALS = ['leather', 'canvas', 'plastic', 'metal', 'denim', 'nylon', 'cotton', 'rubber']
+THINGS = [
+    'wallet', 'umbrella', 'tumbler', 'jacket', 'backpack', 'calculator', 'charger', 'notebook',
+    'ID lace', 'watch', 'cap', 'pencil case', 'lunch box', 'phone', 'earphones', 'eyeglasses',
+    'keychain', 'hoodie', 'water bottle', 'sneakers',
+]
+LOCATIONS = [
+    'Library', 'Canteen', 'Gymnasium', 'Chapel', 'Covered Court', 'Main Lobby', 'Science Lab',
+    'Computer Lab', 'Room 201', 'Room 305', 'Parking Lot', 'Guard House', 'Field', 'Clinic',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with generated items, a category tree, pending categories, "
+        "users and watches, for trying the app or benchmarking it (see bench_lnf)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--watches', type=int, default=10, help="Items watched per user, on average.")
+        parser.add_argument('--days', type=int, default=365, help="How far back the found dates go.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data.")
+        parser.add_argument(
+            '--clear', action='store_true',
+            help="Delete all items, categories, pending categories and seeded users first.",
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        if options['categories'] > len(CATEGORY_NAMES) * 10:
+            raise CommandError(f"At most {len(CATEGORY_NAMES) * 10} categories.")
+
+        with transaction.atomic():
+            if options['clear']:
+                clear()
+            elif User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+                raise CommandError("The database already has seeded data; run with --clear to replace it.")
+            users = self.create_users(options['users'])
+            categories = self.create_categories(options['categories'])
+            pending = self.create_pending_categories()
+            items = self.create_items(options['items'], users, categories, pending, options['days'])
+            watches = self.create_watches(users, items, options['watches'])
+            transaction.on_commit(bump_items_generation)
+            transaction.on_commit(bump_catalogue_version)
+
+        # bulk_create skips the signals that keep the search index up to date
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(items)} items, {len(categories)} categories, {len(pending)} pending categories, "
+            f"{len(users)} users and {watches} watches."
+        ))
+
+    def create_users(self, count):
+        # Seeded users cannot log in with a password; use the admin or force_login
+        password = make_password(None)
+        User.objects.bulk_create(
+            User(username=f'{USERNAME_PREFIX}{number}', email=f'{USERNAME_PREFIX}{number}@example.com', password=password)
+            for number in range(count)
+        )
+        return list(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('pk', flat=True))
+
+    def create_categories(self, count):
+        """A tree a few levels deep: a quarter are roots, the rest go under an earlier category."""
+        names = [
+            name if round_number == 0 else f'{name} {round_number + 1}'
+            for round_number in range(10) for name in CATEGORY_NAMES
+        ][:count]
+        categories = []
+        for number, name in enumerate(names):
+            parent = None
+            if number >= max(1, count // 4):
+                parent = self.random.choice([category for category in categories if category.depth < 2])
+            # save() maintains the materialized path, so no bulk_create here
+            category = Category(name=name, parent=parent)
+            category.save()
+            categories.append(category)
+        return [category.pk for category in categories]
+
+    def create_pending_categories(self):
+        PendingCategory.objects.bulk_create(
+            [PendingCategory(name=name) for name in PENDING_NAMES], ignore_conflicts=True,
+        )
+        return PENDING_NAMES
+
+    def create_items(self, count, users, categories, pending, days):
+        choice = self.random.choice
+        today = timezone.localdate()
+        now = timezone.now()
+        change_seq = next_change_seq()
+        batch = []
+        for number in range(count):
+            found_date = today - datetime.timedelta(days=int(self.random.triangular(0, days, 0)))
+            pub_date = now - datetime.timedelta(days=(today - found_date).days, seconds=self.random.randrange(86400))
+            # Most items end up retrieved after a while, like on the real site
+            age = (today - found_date).days
+            status = 'retrieved' if self.random.random() < min(0.9, age / 60) else choice(
+                ['not_at_repository', 'at_repository'],
+            )
+            item = Item(
+                name=f'{choice(COLOURS).capitalize()} {choice(MATERIALS)} {choice(THINGS)}',
+                description=f'Found near the {choice(LOCATIONS).lower()}, {choice(["no", "with a", "with two"])} '
+                            f'{choice(["name tag", "sticker", "scratch", "keychain"])}.',
+                found_location=choice(LOCATIONS),
+                found_date=found_date,
+                pub_date=pub_date,
+                status=status,
+                uploaded_by_id=choice(users) if users else None,
+                change_seq=change_seq + number,
+            )
+            if categories and self.random.random() < 0.9:
+                item.category_id = choice(categories)
+            else:
+                item.pending_category_name = choice(pending)
+            if status == 'retrieved' and users:
+                item.retrieved_by_id = choice(users)
+            batch.append(item)
+        Item.objects.bulk_create(batch, batch_size=1000)
+        return list(Item.objects.values_list('pk', flat=True))
+
+    def create_watches(self, users, items, per_user):
+        if not items:
+            return 0
+        Watch = Item.held_by.through
+        watches = []
+        for user_id in users:
+            count = min(len(items), int(self.random.expovariate(1 / per_user))) if per_user else 0
+            watches.extend(Watch(user_id=user_id, item_id=item_id) for item_id in self.random.sample(items, count))
+        Watch.objects.bulk_create(watches, batch_size=1000, ignore_conflicts=True)
+        return len(watches)
+
+
+def clear():
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+    Item.objects.all().delete()
+    PendingCategory.objects.all().delete()
+    # Children first: categories protect their subcategories
+    for category in Category.objects.order_by('-path'):
+        category.delete()
@@ -0,0 +1,204 @@
+"""
+Per-request SQL and template timing.
+
+RequestMetricsMiddleware installs an ``execute_wrapper`` on every database
+connection for the duration of a request, counting and timing the queries
+and keeping the slowest few. The template backend of mysite/settings.py
+(TimedDjangoTemplates) adds the time spent rendering. Each response gets a
+``Server-Timing`` header (for staff, or everyone in DEBUG), so the split
+shows in the browser's network panel, and one JSON log line on the
+'lnf.metrics' logger: a warning for requests slower than
+LNF_SLOW_REQUEST_MS, info for the rest. Recent requests are kept per endpoint in a rolling
+window, summarized as histograms at /metrics/ for staff. The window lives
+in the process: with several workers each one reports its own requests.
+"""
+import collections
+import contextlib
+import contextvars
+import heapq
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+# Requests kept per endpoint
+WINDOW = getattr(settings, 'LNF_METRICS_WINDOW', 1000)
+SLOW_QUERIES = getattr(settings, 'LNF_METRICS_SLOW_QUERIES', 3)
+# Requests slower than this are logged as warnings
+SLOW_REQUEST_MS = getattr(settings, 'LNF_SLOW_REQUEST_MS', 500)
+SERVER_TIMING_PUBLIC = getattr(settings, 'LNF_SERVER_TIMING_PUBLIC', False)
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current = contextvars.ContextVar('lnf_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.rendering = False
+        # (seconds, alias, sql) of the slowest statements, as a min-heap
+        self.slowest = []
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            entry = (elapsed, context['connection'].alias, sql)
+            if len(self.slowest) < SLOW_QUERIES:
+                heapq.heappush(self.slowest, entry)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    @contextlib.contextmanager
+    def rendering_template(self):
+        # Templates rendered while rendering another one are already being timed
+        if self.rendering:
+            yield
+            return
+        self.rendering = True
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.template_seconds += time.perf_counter() - started
+            self.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each render for the request metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        with metrics.rendering_template():
+            return self.template.render(context, request)
+
+
+class EndpointWindows:
+    """The timings of the last WINDOW requests of each endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def add(self, endpoint, total_ms, db_ms, template_ms, queries):
+        with self._lock:
+            window = self._windows.get(endpoint)
+            if window is None:
+                window = self._windows[endpoint] = collections.deque(maxlen=WINDOW)
+            window.append((total_ms, db_ms, template_ms, queries))
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+    def snapshot(self):
+        with self._lock:
+            windows = {endpoint: list(window) for endpoint, window in self._windows.items()}
+        return {endpoint: _summarize(samples) for endpoint, samples in sorted(windows.items())}
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def _summarize(samples):
+    totals = sorted(sample[0] for sample in samples)
+    histogram = {}
+    for bound in BUCKETS_MS:
+        histogram[f'le_{bound}'] = sum(1 for total in totals if total <= bound)
+    histogram['le_inf'] = len(totals)
+    count = len(samples)
+    return {
+        'count': count,
+        'p50_ms': round(_percentile(totals, 0.5), 2),
+        'p95_ms': round(_percentile(totals, 0.95), 2),
+        'p99_ms': round(_percentile(totals, 0.99), 2),
+        'mean_db_ms': round(sum(sample[1] for sample in samples) / count, 2),
+        'mean_template_ms': round(sum(sample[2] for sample in samples) / count, 2),
+        'mean_queries': round(sum(sample[3] for sample in samples) / count, 1),
+        # Cumulative, like Prometheus buckets
+        'histogram': histogram,
+    }
+
+
+windows = EndpointWindows()
+
+
+class RequestMetricsMiddleware:
+    """Time the SQL and template work of each request; see the module docstring."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with contextlib.ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total_ms = (time.perf_counter() - metrics.started) * 1000
+        db_ms = metrics.db_seconds * 1000
+        template_ms = metrics.template_seconds * 1000
+        match = request.resolver_match
+        endpoint = f'{request.method} {match.view_name if match else "unresolved"}'
+        windows.add(endpoint, total_ms, db_ms, template_ms, metrics.queries)
+
+        user = getattr(request, 'user', None)
+        if SERVER_TIMING_PUBLIC or settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={db_ms:.2f};desc="{metrics.queries} queries"',
+                f'tpl;dur={template_ms:.2f};desc="templates"',
+                f'total;dur={total_ms:.2f}',
+            ])
+
+        record = {
+            'endpoint': endpoint,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'db_ms': round(db_ms, 2),
+            'template_ms': round(template_ms, 2),
+            'queries': metrics.queries,
+            'slowest': [
+                {'ms': round(seconds * 1000, 2), 'db': alias, 'sql': sql[:500]}
+                for seconds, alias, sql in sorted(metrics.slowest, reverse=True)
+            ],
+        }
+        level = logging.WARNING if total_ms >= SLOW_REQUEST_MS else logging.INFO
+        logger.log(level, json.dumps(record))
+        return response
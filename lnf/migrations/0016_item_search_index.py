@@ -0,0 +1,54 @@
+from django.db import migrations
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lnf_item_fts USING fts5("
+    "name, description, found_location, category_name, tokenize='unicode61 remove_diacritics 2')"
+)
+POSTGRESQL_CREATE = [
+    "CREATE TABLE IF NOT EXISTS lnf_item_search ("
+    "item_id bigint PRIMARY KEY REFERENCES lnf_item (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS lnf_item_search_document_gin ON lnf_item_search USING GIN (document)",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+    elif vendor == 'postgresql':
+        for statement in POSTGRESQL_CREATE:
+            schema_editor.execute(statement)
+    else:
+        return
+
+    from lnf.search import BACKENDS
+
+    backend = BACKENDS[vendor]()
+    Item = apps.get_model('lnf', 'Item')
+    batch = []
+    for item in Item.objects.using(schema_editor.connection.alias).select_related('category').iterator(chunk_size=500):
+        batch.append(item)
+        if len(batch) == 500:
+            backend.index(batch)
+            batch = []
+    backend.index(batch)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS lnf_item_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS lnf_item_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lnf', '0015_alter_category_options_alter_pendingcategory_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_trigrams(apps, schema_editor):
+    from lnf.search import trigrams
+
+    Item = apps.get_model('lnf', 'Item')
+    ItemTrigram = apps.get_model('lnf', 'ItemTrigram')
+    db_alias = schema_editor.connection.alias
+    postings = []
+    for item in Item.objects.using(db_alias).select_related('category').iterator(chunk_size=500):
+        category_name = item.category.name if item.category_id else (item.pending_category_name or '')
+        postings.extend(
+            ItemTrigram(item_id=item.pk, gram=gram)
+            for gram in trigrams(f'{item.name} {item.found_location} {category_name}')
+        )
+        if len(postings) >= 5000:
+            ItemTrigram.objects.using(db_alias).bulk_create(postings)
+            postings = []
+    ItemTrigram.objects.using(db_alias).bulk_create(postings)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lnf', '0016_item_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='lnf.item')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('gram', 'item'), name='lnf_itemtrigram_gram_item_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_trigrams, migrations.RunPython.noop),
+    ]
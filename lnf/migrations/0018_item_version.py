@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lnf', '0017_itemtrigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:34
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('lnf', 'Category')
+    db_alias = schema_editor.connection.alias
+    categories = list(Category.objects.using(db_alias).all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+    stack = [(category, '/') for category in children.get(None, [])]
+    while stack:
+        category, parent_path = stack.pop()
+        category.path = f'{parent_path}{category.pk}/'
+        stack.extend((child, category.path) for child in children.get(category.pk, []))
+    Category.objects.using(db_alias).bulk_update(categories, ['path'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lnf', '0019_item_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:49
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lnf', '0023_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='found_date',
+            field=models.DateField(verbose_name='date found'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('status', 'retrieved'), _negated=True), fields=['found_date', 'id'], name='lnf_item_feed_found_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('status', 'retrieved'), _negated=True), fields=['pub_date', 'id'], name='lnf_item_feed_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), condition=models.Q(('status', 'retrieved'), _negated=True), name='lnf_item_feed_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['found_date', 'id'], name='lnf_item_found_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['pub_date', 'id'], name='lnf_item_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), name='lnf_item_name_idx'),
+        ),
+    ]
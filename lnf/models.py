@@ -1,11 +1,28 @@
 import datetime
+import time
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Concat, Lower, Substr
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import FileExtensionValidator
 
 # Create your models here.
+def subtree_filter(paths, field='path'):
+    """
+    Q matching the categories (or, with a related ``field``, the rows) under
+    any of the given materialized paths, the nodes themselves included.
+    Paths end in '/' and the next character is '0', so each subtree is the
+    index-friendly range [path, path[:-1] + '0').
+    """
+    q = Q()
+    for path in paths:
+        q |= Q(**{f'{field}__gte': path, f'{field}__lt': path[:-1] + '0'})
+    return q
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     parent = models.ForeignKey(
@@ -15,6 +32,8 @@ class Category(models.Model):
         null=True,
         blank=True
     )
+    # Materialized path of ids from the root, e.g. "/3/12/"; maintained by save()
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
 
     class Meta:
         verbose_name_plural = "categories"
@@ -22,6 +41,42 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def depth(self):
+        return self.path.count('/') - 2
+
+    def _parent_path(self):
+        if not self.parent_id:
+            return '/'
+        return Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+
+    def clean(self):
+        super().clean()
+        if self.pk and self.parent_id and self._parent_path().startswith(self.path):
+            raise ValidationError({'parent': 'A category cannot be moved under itself or one of its subcategories.'})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            old_path = self.path
+            if self.pk is None:
+                super().save(*args, **kwargs)
+                self.path = f'{self._parent_path()}{self.pk}/'
+                Category.objects.filter(pk=self.pk).update(path=self.path)
+                return
+
+            parent_path = self._parent_path()
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('A category cannot be moved under itself or one of its subcategories.')
+            self.path = f'{parent_path}{self.pk}/'
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'path'}
+            super().save(*args, **kwargs)
+            if old_path and old_path != self.path:
+                # Moved: re-root the whole subtree with one UPDATE
+                Category.objects.filter(subtree_filter([old_path])).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1))
+                )
+
 class PendingCategory(models.Model):
     name = models.CharField(max_length=100, unique=True)
 
@@ -31,6 +86,39 @@ class PendingCategory(models.Model):
     def __str__(self):
         return self.name
 
+def next_change_seq():
+    """
+    The change sequence for a write happening now: a timestamp in microseconds,
+    so it needs no shared counter and keeps growing across restarts.
+    """
+    return time.time_ns() // 1000
+
+
+class ItemQuerySet(models.QuerySet):
+    def touch(self, **fields):
+        """
+        Bulk-update ``fields`` and bump the version of every matched item,
+        for writes that bypass Item.save() but must still invalidate cached rows.
+        """
+        from .caching import bump_items_generation
+
+        updated = self.update(version=models.F('version') + 1, change_seq=next_change_seq(), **fields)
+        if updated:
+            transaction.on_commit(bump_items_generation)
+        return updated
+
+
+def image_thumbnail_url(name, variants):
+    """Thumbnail URL from the raw ``image`` and ``image_variants`` column values of an item."""
+    if not name:
+        return ''
+    storage = Item._meta.get_field('image').storage
+    jpeg_variants = (variants or {}).get('jpeg')
+    if jpeg_variants:
+        return storage.url(jpeg_variants[min(jpeg_variants, key=int)])
+    return storage.url(name)
+
+
 class Item(models.Model):
     STATUS_CHOICES = [
         ('not_at_repository', 'Not at Prefect Office'),
@@ -49,16 +137,155 @@ class Item(models.Model):
         validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'])]
     )
     found_location = models.CharField(max_length=100)
-    found_date = models.DateField(verbose_name='date found', db_index=True)
+    found_date = models.DateField(verbose_name='date found')
     pub_date = models.DateTimeField(verbose_name='date published')
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploaded_items')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='not_at_repository', db_index=True)
     retrieved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='retrieved_items')
     held_by = models.ManyToManyField(User, blank=True, related_name='held_items')
+    # Storage names of the resized copies of `image` by format and width, see lnf.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Bumped on every write; keys the cached row fragments in lnf.fragments
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # When the item was last written, for delta sync (see lnf.sync)
+    change_seq = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    objects = ItemQuerySet.as_manager()
+
+    class Meta:
+        # One index per feed ordering (ItemFilterForm.sort_by), ending with the
+        # id that keyset pagination sorts by last, so a page is read straight
+        # off the index instead of sorting every match. The partial ones only
+        # hold what the feed shows by default: retrieved items pile up over
+        # time but are only listed on request.
+        indexes = [
+            models.Index(fields=['found_date', 'id'], name='lnf_item_feed_found_idx', condition=~Q(status='retrieved')),
+            models.Index(fields=['pub_date', 'id'], name='lnf_item_feed_pub_idx', condition=~Q(status='retrieved')),
+            models.Index(Lower('name'), 'id', name='lnf_item_feed_name_idx', condition=~Q(status='retrieved')),
+            # The same orderings with retrieved items included
+            models.Index(fields=['found_date', 'id'], name='lnf_item_found_idx'),
+            models.Index(fields=['pub_date', 'id'], name='lnf_item_pub_idx'),
+            models.Index(Lower('name'), 'id', name='lnf_item_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the change events tell a status change from other edits (see lnf.signals)
+        instance._loaded_status = values[field_names.index('status')] if 'status' in field_names else None
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        self.change_seq = next_change_seq()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'change_seq'}
+        super().save(*args, **kwargs)
+        # The post_save receivers have seen the change by now
+        self._loaded_status = self.status
     
+    def image_srcset(self, fmt='jpeg'):
+        """The ``srcset`` of the resized copies of the image, or '' until they have been generated."""
+        if not self.image:
+            return ''
+        storage = self.image.storage
+        variants = self.image_variants.get(fmt, {})
+        return ', '.join(
+            f'{storage.url(name)} {width}w'
+            for width, name in sorted(variants.items(), key=lambda variant: int(variant[0]))
+        )
+
+    @property
+    def image_webp_srcset(self):
+        return self.image_srcset('webp')
+
+    @property
+    def thumbnail_url(self):
+        """URL of the smallest image variant, falling back to the original image."""
+        return image_thumbnail_url(self.image.name if self.image else None, self.image_variants)
+
     def was_published_recently(self):
         now = timezone.now()
-        return now - datetime.timedelta(days=1) <= self.pub_date <= now
\ No newline at end of file
+        return now - datetime.timedelta(days=1) <= self.pub_date <= now
+
+class Notification(models.Model):
+    """An inbox entry telling a watcher that an item's status changed, written by lnf.notifications."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='notifications')
+    status = models.CharField(max_length=20, choices=Item.STATUS_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'read_at'], name='lnf_notif_user_read_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.item} is now {self.get_status_display()}'
+
+
+class ItemTombstone(models.Model):
+    """Marks a deleted item so delta sync can tell clients to drop it; pruned after a while."""
+    item_id = models.BigIntegerField()
+    deleted_seq = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f'Deleted item {self.item_id}'
+
+
+class ItemTrigram(models.Model):
+    """Trigram postings for typo-tolerant search, maintained by lnf.search."""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='trigrams')
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gram', 'item'], name='lnf_itemtrigram_gram_item_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.gram!r} -> {self.item_id}'
+
+
+class Job(models.Model):
+    """A unit of background work, claimed and run by ``manage.py runworkers`` (see lnf.jobs)."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # Token of the claim that is running the job
+    locked_by = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Only queued jobs are ever looked up by priority, so only they are indexed
+            models.Index(
+                fields=['-priority', 'run_after', 'id'],
+                name='lnf_job_queued_idx',
+                condition=Q(status='queued'),
+            ),
+            models.Index(fields=['status', 'locked_at'], name='lnf_job_status_locked_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
@@ -0,0 +1,111 @@
+"""
+Notifying watchers when the status of an item changes.
+
+Saves only record which items changed, once their transaction commits; a
+background thread picks the changes up a moment later in one batch, so an
+admin changing many rows at once (list_editable or a bulk action) pays for
+neither the fan-out nor the emails. For each batch the watchers are read in
+one query and the inbox rows written with ``bulk_create``. A user keeps at
+most one unread notification per item: a newer change replaces it, and an
+email lists all of a user's items of the batch at once.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import send_mass_mail
+from django.db import close_old_connections, transaction
+
+from .sqlite import serialized_write
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'LNF_NOTIFY_BATCH_SIZE', 500)
+# How long changes are collected before a batch is sent out
+BATCH_DELAY = getattr(settings, 'LNF_NOTIFY_BATCH_DELAY', 0.5)
+SEND_EMAIL = getattr(settings, 'LNF_NOTIFY_EMAIL', False)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lnf-notify')
+_lock = threading.Lock()
+_pending = set()
+_scheduled = False
+
+
+def status_changed(item_ids):
+    """Notify the watchers of ``item_ids`` once the current transaction commits."""
+    item_ids = list(item_ids)
+    if item_ids:
+        transaction.on_commit(lambda: _enqueue(item_ids))
+
+
+def _enqueue(item_ids):
+    global _scheduled
+    with _lock:
+        _pending.update(item_ids)
+        if _scheduled:
+            return
+        _scheduled = True
+    _executor.submit(_run)
+
+
+def _run():
+    global _scheduled
+    time.sleep(BATCH_DELAY)
+    with _lock:
+        item_ids = sorted(_pending)
+        _pending.clear()
+        _scheduled = False
+    try:
+        for start in range(0, len(item_ids), BATCH_SIZE):
+            fan_out(item_ids[start:start + BATCH_SIZE])
+    except Exception:
+        logger.exception('Could not notify the watchers of items %s', item_ids)
+    finally:
+        close_old_connections()
+
+
+def fan_out(item_ids):
+    """Write the inbox rows (and send the emails) for the current status of ``item_ids``."""
+    from .models import Item, Notification
+
+    items = {item.pk: item for item in Item.objects.filter(pk__in=item_ids).only('id', 'name', 'status')}
+    watches = list(
+        Item.held_by.through.objects.filter(item_id__in=items).values_list('item_id', 'user_id')
+    )
+    if not watches:
+        return 0
+
+    notifications = [
+        Notification(user_id=user_id, item_id=item_id, status=items[item_id].status)
+        for item_id, user_id in watches
+    ]
+    with serialized_write():
+        # The new notification supersedes any unread one about the same item
+        Notification.objects.filter(item_id__in=items, read_at__isnull=True).delete()
+        Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+
+    if SEND_EMAIL:
+        _send_emails(items, watches)
+    return len(notifications)
+
+
+def _send_emails(items, watches):
+    from django.contrib.auth.models import User
+
+    items_by_user = {}
+    for item_id, user_id in watches:
+        items_by_user.setdefault(user_id, []).append(items[item_id])
+    users = User.objects.filter(pk__in=items_by_user).exclude(email='').only('id', 'email')
+    messages = []
+    for user in users:
+        lines = [f'- {item.name}: {item.get_status_display()}' for item in items_by_user[user.pk]]
+        messages.append((
+            'Update on items you are watching',
+            'The status of items you are watching has changed:\n\n' + '\n'.join(lines),
+            None,
+            [user.email],
+        ))
+    # One connection for the whole batch
+    send_mass_mail(messages, fail_silently=True)
@@ -0,0 +1,144 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = getattr(settings, 'LNF_PAGE_SIZE', 50)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {value!r} in a cursor')
+
+
+def encode_cursor(values):
+    """Pack the ordering values of the last row into an opaque URL-safe token."""
+    raw = json.dumps(values, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+def get_ordering(queryset):
+    """
+    Return the queryset ordering as (field, descending) pairs, always ending
+    with the primary key so that every row has a unique position.
+    """
+    ordering = []
+    for term in queryset.query.order_by:
+        if not isinstance(term, str):
+            raise ValueError('Keyset pagination needs plain field or annotation names in order_by().')
+        ordering.append((term.lstrip('-'), term.startswith('-')))
+    if not any(field in ('id', 'pk') for field, _ in ordering):
+        last_descending = ordering[-1][1] if ordering else True
+        ordering.append(('id', last_descending))
+    return ordering
+
+
+def _after(ordering, values):
+    """
+    Build the "strictly after this row" condition for the given ordering:
+    (a > x) OR (a = x AND b > y) OR ...
+    The leading column also gets an inclusive bound so the database can seek
+    straight into its index instead of evaluating the OR for every row.
+    """
+    condition = Q()
+    equal = Q()
+    for (field, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending else 'gt'
+        condition |= equal & Q(**{f'{field}__{lookup}': value})
+        equal &= Q(**{field: value})
+    first_field, first_descending = ordering[0]
+    bound = Q(**{f"{first_field}__{'lte' if first_descending else 'gte'}": values[0]})
+    return bound & condition
+
+
+def _order_by(ordering):
+    return [f"{'-' if descending else ''}{field}" for field, descending in ordering]
+
+
+def _decode(cursor, ordering):
+    values = decode_cursor(cursor)
+    if len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def _page(queryset, ordering, cursor_values, page_size):
+    """The rows after ``cursor_values`` (or from the start, if None), one more than a page."""
+    queryset = queryset.order_by(*_order_by(ordering))
+    if cursor_values is not None:
+        try:
+            queryset = queryset.filter(_after(ordering, cursor_values))
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(cursor_values)
+    return list(queryset[:page_size + 1])
+
+
+def _finish(items, ordering, page_size):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        # Rows are model instances or, for .values() querysets, dicts
+        if isinstance(last, dict):
+            next_cursor = encode_cursor([last[field] for field, _ in ordering])
+        else:
+            next_cursor = encode_cursor([getattr(last, field) for field, _ in ordering])
+    return items, next_cursor
+
+
+def paginate(queryset, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return one page of ``queryset`` starting after ``cursor`` together with
+    the cursor for the next page (None on the last page). A ``.values()``
+    queryset must include the ordering fields.
+    """
+    ordering = get_ordering(queryset)
+    values = _decode(cursor, ordering) if cursor else None
+    return _finish(_page(queryset, ordering, values, page_size), ordering, page_size)
+
+
+def paginate_split(queryset, first, cursor=None, page_size=PAGE_SIZE):
+    """
+    paginate() for a queryset ordered first by a descending boolean annotation
+    that is true exactly for the rows matching the filter ``first`` (e.g.
+    ``-is_held_by_user`` and the user's watches). No index can serve that
+    ordering, so the two groups are read as separate queries ordered by the
+    rest of it: the ``first`` rows, then the others. Cursors are the same as
+    paginate() would use.
+    """
+    ordering = get_ordering(queryset)
+    flag, rest = ordering[0][0], ordering[1:]
+    in_first, after = True, None
+    if cursor:
+        values = _decode(cursor, ordering)
+        if not isinstance(values[0], bool):
+            raise InvalidCursor(cursor)
+        in_first, after = values[0], values[1:]
+
+    items = []
+    if in_first:
+        items = _page(queryset.filter(first), rest, after, page_size)
+        after = None
+    if len(items) <= page_size:
+        items += _page(queryset.exclude(first), rest, after, page_size - len(items))
+    return _finish(items, [(flag, True)] + rest, page_size)
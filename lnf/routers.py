@@ -0,0 +1,83 @@
+"""
+Read-replica routing for the read-heavy item views.
+
+Views wrapped in ``reads_from_replica`` read this app's models from the
+'replica' database alias, when one is configured (see mysite/settings.py);
+everything else, and every write, uses 'default'. Replicas lag a little
+behind, so a client that just wrote something (any unsafe request) keeps
+reading from the primary for LNF_REPLICA_PIN_SECONDS, so it sees its own
+changes. Sessions and users are always read from the primary, and so is
+anything that is about to be cached under the current items generation or
+catalogue version (``primary_reads``): a lagging replica could otherwise
+store data from before the write that bumped them.
+"""
+import contextlib
+import contextvars
+import functools
+
+from django.conf import settings
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'lnf_pin_primary'
+PIN_SECONDS = getattr(settings, 'LNF_REPLICA_PIN_SECONDS', 5)
+
+_read_alias = contextvars.ContextVar('lnf_read_alias', default=None)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def reads_from_replica(view):
+    """Decorate a read-only view so its queries on this app's models go to the replica."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replica_configured() or PIN_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        token = _read_alias.set(REPLICA_ALIAS)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Read from the primary inside the block, even within a replica-reading view."""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias and model._meta.app_label == 'lnf':
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+class PinPrimaryAfterWriteMiddleware:
+    """Mark clients that just made an unsafe request so they read from the primary for a while."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if replica_configured() and request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(PIN_COOKIE, '1', max_age=PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
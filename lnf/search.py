@@ -0,0 +1,254 @@
+"""
+Full-text search over items.
+
+Each database gets its own index: an FTS5 virtual table on SQLite and a
+tsvector table with a GIN index on PostgreSQL. Other databases fall back to
+``icontains`` lookups. When a query has no full-text matches (usually a typo)
+the search falls back to the ``ItemTrigram`` postings table, which ranks items
+by the trigrams they share with the query. Both indexes are kept in sync from
+the Item and Category signals in ``lnf.signals``.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Count, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Share of the query's trigrams an item must contain to count as a fuzzy match
+TRIGRAM_THRESHOLD = 0.5
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(text):
+    """
+    The set of trigrams of every word in ``text``. Words are padded like
+    pg_trgm does ("  cat ") so that word starts and ends carry more weight.
+    """
+    grams = set()
+    for token in tokenize(text):
+        padded = f'  {token} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _document(item):
+    """The searchable text of an item, in the column order of the index."""
+    category_name = item.category.name if item.category_id else (item.pending_category_name or '')
+    return (item.name, item.description, item.found_location, category_name)
+
+
+def _index_trigrams(items):
+    from .models import ItemTrigram
+
+    items = list(items)
+    ItemTrigram.objects.filter(item__in=[item.pk for item in items]).delete()
+    postings = []
+    for item in items:
+        name, _, found_location, category_name = _document(item)
+        postings.extend(
+            ItemTrigram(item_id=item.pk, gram=gram)
+            for gram in trigrams(f'{name} {found_location} {category_name}')
+        )
+    ItemTrigram.objects.bulk_create(postings, batch_size=1000)
+
+
+def trigram_search(queryset, query):
+    """
+    Filter ``queryset`` to items sharing at least TRIGRAM_THRESHOLD of the
+    query's trigrams, with ``search_rank`` set to the share they contain.
+    Lookups go through the (gram, item) index, so no table scan is needed.
+    """
+    from .models import ItemTrigram
+
+    grams = trigrams(query)
+    if not grams:
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    min_hits = max(1, round(len(grams) * TRIGRAM_THRESHOLD))
+    hits = ItemTrigram.objects.filter(gram__in=grams).values('item_id').annotate(hits=Count('*'))
+    return queryset.filter(
+        id__in=hits.filter(hits__gte=min_hits).values('item_id')
+    ).annotate(
+        search_rank=Subquery(
+            hits.filter(item_id=OuterRef('pk')).values('hits'),
+            output_field=FloatField(),
+        ) / Value(float(len(grams))),
+    )
+
+
+class SQLiteSearchBackend:
+    table = 'lnf_item_fts'
+    # bm25() weights for name, description, found_location and category_name
+    weights = (10.0, 1.0, 4.0, 3.0)
+
+    def match_expression(self, query):
+        # Quote every token (so FTS5 syntax in user input is inert) and match it as a prefix,
+        # which keeps results flowing while the user is still typing a word.
+        tokens = tokenize(query)
+        return ' '.join(f'"{token}"*' for token in tokens) if tokens else None
+
+    def index(self, items):
+        rows = [(item.pk, *_document(item)) for item in items]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description, found_location, category_name) '
+                'VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, item_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in item_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if match is None:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        item_id = f'{connection.ops.quote_name(queryset.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+        ).annotate(
+            # bm25() is lower for better matches, so negate it to rank in descending order
+            search_rank=RawSQL(
+                f'SELECT -bm25({self.table}, {weights}) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND rowid = {item_id}',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgreSQLSearchBackend:
+    table = 'lnf_item_search'
+    config = 'simple'
+    # setweight() labels for name, description, found_location and category_name
+    labels = ('A', 'D', 'B', 'C')
+
+    def match_expression(self, query):
+        tokens = tokenize(query)
+        return ' & '.join(f'{token}:*' for token in tokens) if tokens else None
+
+    def index(self, items):
+        document = ' || '.join(
+            f"setweight(to_tsvector('{self.config}', %s), '{label}')" for label in self.labels
+        )
+        rows = [(item.pk, *_document(item)) for item in items]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (item_id, document) VALUES (%s, {document}) '
+                'ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove(self, item_ids):
+        # Rows are also removed by the ON DELETE CASCADE foreign key; this covers raw deletes.
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE item_id = ANY(%s)', [list(item_ids)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if match is None:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        item_id = f'{connection.ops.quote_name(queryset.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        tsquery = f"to_tsquery('{self.config}', %s)"
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT item_id FROM {self.table} WHERE document @@ {tsquery}', [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT ts_rank(document, {tsquery}) FROM {self.table} WHERE item_id = {item_id}',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+
+class IContainsSearchBackend:
+    """Unindexed fallback for databases without a native full-text index."""
+
+    def index(self, items):
+        pass
+
+    def remove(self, item_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, queryset, query):
+        for token in tokenize(query):
+            queryset = queryset.filter(
+                Q(name__icontains=token) |
+                Q(description__icontains=token) |
+                Q(found_location__icontains=token) |
+                Q(category__name__icontains=token) |
+                Q(pending_category_name__icontains=token)
+            )
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, IContainsSearchBackend)()
+
+
+def index_items(items):
+    items = list(items)
+    get_backend().index(items)
+    _index_trigrams(items)
+
+
+def remove_items(item_ids):
+    # Trigram postings go away with the item through their cascading foreign key.
+    get_backend().remove(item_ids)
+
+
+def search_items(queryset, query, fuzzy=True):
+    """
+    Filter ``queryset`` to items matching ``query`` and annotate their ``search_rank``.
+    With ``fuzzy``, a query without full-text matches is retried as a trigram search.
+    """
+    results = get_backend().search(queryset, query)
+    if fuzzy and not results.exists():
+        results = trigram_search(queryset, query)
+    return results
+
+
+def rebuild_index(batch_size=500):
+    from .models import Item, ItemTrigram
+
+    backend = get_backend()
+    backend.clear()
+    ItemTrigram.objects.all().delete()
+    items = Item.objects.select_related('category').order_by('pk')
+    batch = []
+    for item in items.iterator(chunk_size=batch_size):
+        batch.append(item)
+        if len(batch) == batch_size:
+            backend.index(batch)
+            _index_trigrams(batch)
+            batch = []
+    backend.index(batch)
+    _index_trigrams(batch)
@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import events, notifications, search, sync
+from .caching import bump_items_generation, bump_user_watch_version
+from .catalogue import bump_catalogue_version
+from .models import Category, Item, PendingCategory
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_item_responses(sender, **kwargs):
+    # Wait for the commit, otherwise a concurrent request could cache the old
+    # data under the new generation.
+    transaction.on_commit(bump_items_generation)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=PendingCategory)
+@receiver(post_delete, sender=PendingCategory)
+def invalidate_catalogue(sender, **kwargs):
+    transaction.on_commit(bump_catalogue_version)
+
+
+@receiver(m2m_changed, sender=Item.held_by.through)
+def invalidate_watch_state(sender, instance, action, reverse, pk_set, **kwargs):
+    """Bump the watch version of every user whose watch list changed."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = list(instance.held_by.values_list('pk', flat=True))
+    else:
+        user_ids = pk_set or []
+    for user_id in user_ids:
+        transaction.on_commit(lambda user_id=user_id: bump_user_watch_version(user_id))
+
+
+@receiver(post_save, sender=Item)
+def index_saved_item(sender, instance, raw=False, **kwargs):
+    # Fixtures are loaded raw; run `manage.py rebuild_search_index` afterwards instead.
+    if not raw:
+        search.index_items([instance])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_deleted_item(sender, instance, **kwargs):
+    search.remove_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def record_item_tombstone(sender, instance, **kwargs):
+    # Part of the deleting transaction, so the tombstone exists exactly when the deletion does
+    sync.record_deletion(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_items(sender, instance, created, raw=False, **kwargs):
+    # A renamed category changes the searchable text and the rendered rows of every item in it.
+    if not raw and not created:
+        instance.item_set.touch()
+        search.index_items(instance.item_set.select_related('category'))
+        events.publish_items('updated', instance.item_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Item)
+def publish_item_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    payload = events.item_payload(instance)
+    loaded_status = getattr(instance, '_loaded_status', None)
+    if created:
+        event_type = 'created'
+    elif loaded_status is not None and loaded_status != instance.status:
+        event_type = 'status_changed'
+        payload['previous_status'] = loaded_status
+    else:
+        event_type = 'updated'
+    transaction.on_commit(lambda: events.broker.publish(event_type, payload))
+
+
+@receiver(post_delete, sender=Item)
+def publish_item_deleted(sender, instance, **kwargs):
+    payload = {'id': instance.pk}
+    transaction.on_commit(lambda: events.broker.publish('deleted', payload))
+
+
+@receiver(post_save, sender=Item)
+def notify_watchers(sender, instance, created, raw=False, **kwargs):
+    loaded_status = getattr(instance, '_loaded_status', None)
+    if not raw and not created and loaded_status is not None and loaded_status != instance.status:
+        notifications.status_changed([instance.pk])
@@ -0,0 +1,52 @@
+"""
+Optional in-process serialization of write transactions on SQLite.
+
+SQLite allows one writer at a time. With WAL and ``BEGIN IMMEDIATE`` (see
+mysite/settings.py) concurrent writers wait for each other in the busy
+handler, which polls with growing sleeps. With LNF_SQLITE_WRITE_LOCK on,
+the hot write paths also queue on a lock in the process first, so threads
+of one process take turns in order rather than polling the file lock. It
+does nothing on other databases, and inside a transaction that is already
+open (which holds the database write lock anyway).
+"""
+import contextlib
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+ENABLED = getattr(settings, 'LNF_SQLITE_WRITE_LOCK', False)
+
+_write_lock = threading.Lock()
+
+
+class serialized_write(contextlib.ContextDecorator):
+    """Run the block (or decorated function) in a transaction, one thread at a time when enabled."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def __enter__(self):
+        connection = connections[self.using]
+        self.locked = ENABLED and connection.vendor == 'sqlite' and not connection.in_atomic_block
+        if self.locked:
+            _write_lock.acquire()
+        self.atomic = transaction.atomic(using=self.using)
+        try:
+            self.atomic.__enter__()
+        except BaseException:
+            if self.locked:
+                _write_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return self.atomic.__exit__(exc_type, exc_value, traceback)
+        finally:
+            if self.locked:
+                _write_lock.release()
+
+    def _recreate_cm(self):
+        # A fresh instance per call, so the decorator is safe to use from several threads
+        return type(self)(self.using)
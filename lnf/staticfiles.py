@@ -0,0 +1,174 @@
+"""
+Static files for production: pruned, content-hashed and precompressed.
+
+``collectstatic`` only collects the vendor files the templates use
+(LNF_STATIC_VENDOR_FILES), names every file after a hash of its content
+(see ManifestStaticFilesStorage) and writes a gzip copy, and a brotli copy
+when the Brotli package is installed, next to each compressible file.
+CompressedStaticFilesMiddleware then serves STATIC_ROOT itself, picking the
+smallest copy the client accepts; hashed files never change under their
+name, so they are cached for a year without revalidation. Behind nginx the
+same files can be served with ``gzip_static on; brotli_static on;`` and
+``expires max`` on the hashed names instead.
+"""
+import fnmatch
+import gzip
+import mimetypes
+import os
+from email.utils import formatdate
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import FileSystemFinder
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import parse_http_date_safe
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.svg', '.json', '.txt', '.html', '.xml', '.ttf', '.otf', '.eot', '.ico'}
+# Compressed copies that don't save at least this share of the size are not kept
+MIN_SAVING = 0.05
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Unhashed names (referenced without {% static %}) may change under the same URL
+MUTABLE_CACHE_CONTROL = 'public, max-age=300'
+
+
+class PrunedFileSystemFinder(FileSystemFinder):
+    """
+    FileSystemFinder that leaves the vendor files the site doesn't use out of
+    collectstatic: under each directory of LNF_STATIC_VENDOR_FILES only the
+    paths matching its patterns are collected. Finding single files (as the
+    development server does) still sees everything, source maps included.
+    """
+
+    def list(self, ignore_patterns):
+        vendor_files = getattr(settings, 'LNF_STATIC_VENDOR_FILES', {})
+        for path, storage in super().list(ignore_patterns):
+            top = path.replace(os.sep, '/').split('/', 1)[0]
+            patterns = vendor_files.get(top)
+            if patterns is None or any(fnmatch.fnmatch(path.replace(os.sep, '/'), pattern) for pattern in patterns):
+                yield path, storage
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Templates reference a few files that are not in the repository; link
+    # them unhashed (as before) rather than failing the page
+    manifest_strict = False
+    # The vendor source maps are not collected, so their references are left alone
+    patterns = tuple(
+        (extension, tuple(pattern for pattern in extension_patterns if 'sourceMappingURL' not in str(pattern)))
+        for extension, extension_patterns in ManifestStaticFilesStorage.patterns
+    )
+
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:
+            # Not collected, e.g. in the tests, which don't run collectstatic
+            return StaticFilesStorage.url(self, name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in {*paths, *self.hashed_files.values()}:
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE and self.exists(name):
+                self._compress(name)
+
+    def _compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as file:
+            content = file.read()
+        variants = {'.gz': lambda: gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = lambda: brotli.compress(content, quality=11)
+        for suffix, compress in variants.items():
+            compressed = compress()
+            if len(compressed) <= len(content) * (1 - MIN_SAVING):
+                with open(path + suffix, 'wb') as file:
+                    file.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def accepted_encodings(header):
+    """The codings of an Accept-Encoding header with their q-values; ``q=0`` means not acceptable."""
+    accepted = {}
+    for part in header.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+class CompressedStaticFilesMiddleware:
+    """
+    Serve STATIC_URL from STATIC_ROOT, preferring the brotli or gzip copy
+    the client accepts, with far-future caching for hashed names. Not used
+    until collectstatic has filled STATIC_ROOT; the development server
+    serves static files itself in DEBUG.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.root = str(settings.STATIC_ROOT or '')
+        if not settings.STATIC_URL.startswith('/') or not os.path.isdir(self.root):
+            raise MiddlewareNotUsed
+        self.prefix = settings.STATIC_URL
+        self.hashed = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        headers = {
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if name in self.hashed else MUTABLE_CACHE_CONTROL,
+            'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+            'Vary': 'Accept-Encoding',
+        }
+        modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if modified_since is not None and int(stat.st_mtime) <= modified_since:
+            return HttpResponseNotModified(headers=headers)
+
+        content_type, _ = mimetypes.guess_type(name)
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = None
+        for coding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted.get(coding, accepted.get('*', 0)) > 0 and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, coding
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+        # FileResponse names the file for downloads; these are shown inline
+        del response['Content-Disposition']
+        if encoding:
+            response['Content-Encoding'] = encoding
+        for header, value in headers.items():
+            response[header] = value
+        return response
@@ -0,0 +1,70 @@
+"""
+Delta sync of item lists.
+
+Every item write stamps ``Item.change_seq`` and every deletion leaves an
+``ItemTombstone``, both with microsecond timestamps (``next_change_seq``).
+An items API response carries a ``since`` token; sending it back returns
+only the rows changed after it that match the filters, and the ids to drop
+(deleted, or no longer matching).
+
+Sequence numbers are taken when a write happens but become visible when its
+transaction commits, so a later number can be visible before an earlier
+one. Tokens are therefore held back by SYNC_GRACE_US: rows changed within
+that window are sent again on the next sync rather than risk missing one.
+"""
+from django.conf import settings
+
+from .models import Item, ItemTombstone, next_change_seq
+
+SYNC_GRACE_US = getattr(settings, 'LNF_SYNC_GRACE_SECONDS', 5) * 1_000_000
+# Larger deltas are answered with a reset; reloading the list is cheaper then
+SYNC_MAX_ROWS = getattr(settings, 'LNF_SYNC_MAX_ROWS', 200)
+# Tombstones older than this are pruned; older tokens need a full reload
+TOMBSTONE_RETENTION_US = getattr(settings, 'LNF_TOMBSTONE_RETENTION_DAYS', 30) * 86400 * 1_000_000
+
+
+class SyncExpired(Exception):
+    """The token predates the kept tombstones, so deletions could be missed."""
+
+
+def sync_token():
+    """The ``since`` token for a response built from data read now."""
+    return str(next_change_seq() - SYNC_GRACE_US)
+
+
+def parse_token(value):
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid sync token: {value!r}')
+    if since < 0:
+        raise ValueError(f'Invalid sync token: {value!r}')
+    if since < next_change_seq() - TOMBSTONE_RETENTION_US:
+        raise SyncExpired(value)
+    return since
+
+
+def changes_since(item_list, since):
+    """
+    Split the changes after ``since`` for the filtered ``item_list`` into the
+    matching changed rows (a queryset) and the ids the client should drop.
+    At most SYNC_MAX_ROWS + 1 ids to drop are returned; that many means the
+    client should reload instead.
+    """
+    changed = item_list.filter(change_seq__gt=since)
+    limit = SYNC_MAX_ROWS + 1
+    # Changed rows that no longer match the filters, read off the change_seq index
+    unmatched = (
+        Item.objects.filter(change_seq__gt=since)
+        .exclude(pk__in=changed.order_by().values('pk'))
+        .order_by()
+        .values_list('id', flat=True)[:limit]
+    )
+    deleted = ItemTombstone.objects.filter(deleted_seq__gt=since).order_by().values_list('item_id', flat=True)[:limit]
+    return changed, sorted({*unmatched, *deleted})[:limit]
+
+
+def record_deletion(item_id):
+    now = next_change_seq()
+    ItemTombstone.objects.filter(deleted_seq__lt=now - TOMBSTONE_RETENTION_US).delete()
+    ItemTombstone.objects.create(item_id=item_id, deleted_seq=now)
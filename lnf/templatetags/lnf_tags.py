@@ -0,0 +1,17 @@
+from django import template
+
+from ..fragments import render_item_rows
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def item_rows(context, item_list, view_type):
+    """Render the rows of ``item_list`` through the row fragment cache."""
+    return render_item_rows(
+        item_list,
+        view_type,
+        context['request'],
+        show_delete_button=context.get('show_delete_button', False),
+        on_profile_page=context.get('on_profile_page', False),
+    )
@@ -1,3 +1,913 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import unittest
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import F, Q
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import admin as lnf_admin
+from . import metrics
+from .caching import items_etag, items_generation, user_watch_version
+from .catalogue import get_catalogue
+from .events import broker, item_payload
+from .forms import ItemFilterForm
+from .fragments import ACTIONS_MARKER, PLACEHOLDER_ITEM_ID, WATCH_CLASS_MARKER, render_item_rows
+from .jobs import LEASE_SECONDS, requeue_stale
+from .models import Category, Item, ItemTombstone, ItemTrigram, Job, PendingCategory, next_change_seq
+from .pagination import PAGE_SIZE, InvalidCursor, decode_cursor, encode_cursor, get_ordering, paginate, paginate_split
+from .routers import PIN_COOKIE, PinPrimaryAfterWriteMiddleware, ReplicaRouter, primary_reads, reads_from_replica
+from .search import search_items, trigrams
+from .sqlite import serialized_write
+from .staticfiles import IMMUTABLE_CACHE_CONTROL, MUTABLE_CACHE_CONTROL
+from .sync import SYNC_GRACE_US, TOMBSTONE_RETENTION_US, SyncExpired, parse_token, sync_token
+from .views import _filter_and_sort_items, _paginate_items, index
+from .watching import set_watching, toggle_watch
+
+
+def make_item(**fields):
+    fields.setdefault('name', 'Black wallet')
+    fields.setdefault('found_location', 'Library')
+    fields.setdefault('found_date', timezone.localdate())
+    fields.setdefault('pub_date', timezone.now())
+    return Item.objects.create(**fields)
+
+
+@mock.patch('lnf.routers.replica_configured', return_value=True)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def read_aliases(self, request, extra=None):
+        """The databases the item and user querysets would read from inside a replica-reading view."""
+        @reads_from_replica
+        def view(request):
+            if extra:
+                with extra():
+                    return Item.objects.all().db, User.objects.all().db
+            return Item.objects.all().db, User.objects.all().db
+        return view(request)
+
+    def test_views_read_items_from_the_replica(self, configured):
+        self.assertEqual(self.read_aliases(self.factory.get('/')), ('replica', 'default'))
+
+    def test_reads_outside_views_use_the_primary(self, configured):
+        self.assertEqual(Item.objects.all().db, 'default')
+
+    def test_primary_reads_override_the_view(self, configured):
+        self.assertEqual(self.read_aliases(self.factory.get('/'), primary_reads), ('default', 'default'))
+
+    def test_pinned_clients_read_from_the_primary(self, configured):
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.read_aliases(request), ('default', 'default'))
+
+    def test_writes_go_to_the_primary(self, configured):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_write(Item), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'lnf'))
+        self.assertTrue(router.allow_migrate('default', 'lnf'))
+
+    def test_unsafe_requests_pin_the_client(self, configured):
+        middleware = PinPrimaryAfterWriteMiddleware(lambda request: HttpResponse())
+        self.assertIn(PIN_COOKIE, middleware(self.factory.post('/')).cookies)
+        self.assertNotIn(PIN_COOKIE, middleware(self.factory.get('/')).cookies)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'needs LNF_DB_ENGINE=postgres and a local PostgreSQL server')
+class PostgreSQLTests(TestCase):
+    databases = {'default', 'replica'} if 'replica' in connections.settings else {'default'}
+
+    def test_connections_are_persistent_and_health_checked(self):
+        settings_dict = connection.settings_dict
+        self.assertTrue(settings_dict['CONN_HEALTH_CHECKS'])
+        if 'pool' not in settings_dict['OPTIONS']:
+            self.assertGreater(settings_dict['CONN_MAX_AGE'], 0)
+
+    def test_full_text_search(self):
+        wallet = make_item(name='Black leather wallet')
+        make_item(name='Blue umbrella')
+        self.assertEqual(list(search_items(Item.objects.all(), 'wallets', fuzzy=False)), [wallet])
+
+    @unittest.skipUnless('replica' in connections.settings, 'needs POSTGRES_REPLICA_HOST')
+    def test_items_api_reads_from_the_replica(self):
+        make_item()
+        user = User.objects.create_user('reader', password='secret')
+        self.client.force_login(user)
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get('/api/items/?format=json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('lnf_item' in query['sql'] for query in queries.captured_queries))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+class SQLiteSearchTests(TestCase):
+    def search(self, query, fuzzy=False):
+        return list(search_items(Item.objects.all(), query, fuzzy=fuzzy).order_by('-search_rank', 'pk'))
+
+    def test_full_text_search(self):
+        wallet = make_item(name='Black leather wallet')
+        mentioned = make_item(name='Blue umbrella', description='Left next to a wallet stand')
+        make_item(name='Red cap')
+        # Prefix matches, with name matches ranked first
+        self.assertEqual(self.search('wall'), [wallet, mentioned])
+        self.assertEqual(self.search('black wallet'), [wallet])
+        # FTS5 syntax in the query is matched as plain words
+        self.assertEqual(self.search('wallet OR cap'), [])
+        self.assertEqual(self.search('"wallet" NEAR(cap'), [])
+
+    def test_index_follows_edits_and_deletions(self):
+        item = make_item(name='Black leather wallet')
+        item.name = 'Blue umbrella'
+        item.save()
+        self.assertEqual(self.search('wallet'), [])
+        self.assertEqual(self.search('umbrella'), [item])
+        item.delete()
+        self.assertEqual(self.search('umbrella'), [])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM lnf_item_fts')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_category_renames_are_indexed(self):
+        category = Category.objects.create(name='Umbrellas')
+        item = make_item(name='Blue folding', category=category)
+        self.assertEqual(self.search('umbrellas'), [item])
+        category.name = 'Rain gear'
+        category.save()
+        self.assertEqual(self.search('umbrellas'), [])
+        self.assertEqual(self.search('rain'), [item])
+
+
+class TrigramSearchTests(TestCase):
+    def search(self, query):
+        return list(search_items(Item.objects.all(), query).order_by('-search_rank', 'pk'))
+
+    def postings(self, item_id):
+        return set(ItemTrigram.objects.filter(item_id=item_id).values_list('gram', flat=True))
+
+    def test_typos_fall_back_to_trigrams(self):
+        wallet = make_item(name='Black leather wallet')
+        make_item(name='Blue umbrella')
+        self.assertEqual(list(search_items(Item.objects.all(), 'walet', fuzzy=False)), [])
+        self.assertEqual(self.search('walet'), [wallet])
+        self.assertEqual(self.search('blak walet'), [wallet])
+        self.assertEqual(self.search('xyzzy'), [])
+
+    def test_postings_follow_edits_and_deletions(self):
+        item = make_item(name='Black leather wallet', found_location='Library')
+        self.assertEqual(self.postings(item.pk), trigrams('Black leather wallet Library'))
+        item.name = 'Blue umbrella'
+        item.save()
+        self.assertEqual(self.postings(item.pk), trigrams('Blue umbrella Library'))
+        self.assertEqual(self.search('walet'), [])
+        self.assertEqual(self.search('umbrela'), [item])
+        item_id = item.pk
+        item.delete()
+        self.assertEqual(self.postings(item_id), set())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+class SQLiteConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    ROUNDS = 15
+
+    def test_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def stress(self):
+        """Run concurrent read-then-write transactions and watch toggles; return the errors raised."""
+        items = [make_item(name=f'Item {number}') for number in range(3)]
+        users = [User.objects.create_user(f'user{number}') for number in range(self.THREADS)]
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def writer(user):
+            try:
+                start.wait()
+                for round_number in range(self.ROUNDS):
+                    # Reading first is what makes deferred transactions fail with "database is locked"
+                    with serialized_write():
+                        count = Item.objects.count()
+                        make_item(name=f'{user.username} {round_number} after {count}')
+                    toggle_watch(user, items[round_number % len(items)].pk)
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_writers_do_not_hit_lock_errors(self):
+        self.assertEqual(self.stress(), [])
+        self.assertEqual(Item.objects.count(), 3 + self.THREADS * self.ROUNDS)
+
+    def test_concurrent_writers_with_the_write_lock(self):
+        with mock.patch('lnf.sqlite.ENABLED', True):
+            self.assertEqual(self.stress(), [])
+        self.assertEqual(Item.objects.count(), 3 + self.THREADS * self.ROUNDS)
+
+    def test_deferred_transactions_fail_where_immediate_ones_wait(self):
+        # What BEGIN IMMEDIATE avoids: a deferred transaction that read before
+        # another one committed cannot write, however long it would wait.
+        make_item()
+        first = sqlite3.connect(connection.settings_dict['NAME'], timeout=1, isolation_level=None)
+        second = sqlite3.connect(connection.settings_dict['NAME'], timeout=1, isolation_level=None)
+        try:
+            first.execute('BEGIN')
+            first.execute('SELECT COUNT(*) FROM lnf_item').fetchone()
+            second.execute('BEGIN IMMEDIATE')
+            second.execute("UPDATE lnf_item SET name = 'Changed'")
+            second.execute('COMMIT')
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                first.execute("UPDATE lnf_item SET name = 'Changed again'")
+            first.execute('ROLLBACK')
+        finally:
+            first.close()
+            second.close()
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'reads SQLite query plans')
+class FeedQueryPlanTests(TestCase):
+    """
+    EXPLAIN the queries reading each page of the feed, for every sort order
+    with and without retrieved items: each must walk one of the feed indexes
+    rather than scan the item table or sort all of it.
+    """
+    SORTS = [value for value, _ in ItemFilterForm.base_fields['sort_by'].choices]
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        Item.objects.bulk_create(
+            Item(
+                name=f'Item {number}',
+                found_location='Library',
+                found_date=today - datetime.timedelta(days=number % 30),
+                pub_date=timezone.now(),
+                status='retrieved' if number % 4 == 0 else 'not_at_repository',
+            )
+            for number in range(80)
+        )
+        cls.user = User.objects.create_user('watcher')
+        cls.user.held_items.add(*Item.objects.all()[:3])
+
+    def page_queries(self, user, params, cursor=None):
+        """The SQL of the queries reading one page of the feed, and the next cursor."""
+        request = RequestFactory().get('/', {**params, 'cursor': cursor} if cursor else params)
+        request.user = user
+        item_list, _ = _filter_and_sort_items(request)
+        with CaptureQueriesContext(connection) as queries:
+            _, next_cursor = _paginate_items(request, item_list)
+        return [query['sql'] for query in queries.captured_queries if 'FROM "lnf_item"' in query['sql']], next_cursor
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[3] for row in cursor.fetchall()]
+
+    def assertReadsOffAnIndex(self, sql):
+        plan = self.query_plan(sql)
+        message = f'{sql}\n' + '\n'.join(plan)
+        self.assertNotIn('SCAN lnf_item', plan, message)
+        # Only the user's own watched items may be sorted; they are looked up by id
+        if 'SEARCH lnf_item USING INTEGER PRIMARY KEY (rowid=?)' not in plan:
+            self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], message)
+
+    def test_feed_pages_read_off_an_index(self):
+        for user in (AnonymousUser(), self.user):
+            for sort_by in self.SORTS:
+                for include_retrieved in ('', 'on'):
+                    params = {'sort_by': sort_by, 'include_retrieved': include_retrieved}
+                    with self.subTest(user=user, **params):
+                        queries, next_cursor = self.page_queries(user, params)
+                        self.assertIsNotNone(next_cursor)
+                        more, _ = self.page_queries(user, params, next_cursor)
+                        self.assertTrue(queries and more)
+                        for sql in queries + more:
+                            self.assertReadsOffAnIndex(sql)
+
+    def test_watched_items_still_come_first(self):
+        request = RequestFactory().get('/', {'sort_by': 'name'})
+        request.user = self.user
+        items, _ = _paginate_items(request, _filter_and_sort_items(request)[0])
+        watched = set(self.user.held_items.exclude(status='retrieved'))
+        self.assertEqual(set(items[:len(watched)]), watched)
+        self.assertEqual([item.name.lower() for item in items[len(watched):]],
+                         sorted(item.name.lower() for item in items[len(watched):]))
+
+
+class ItemEventsTests(TestCase):
+    def published(self, write):
+        with mock.patch.object(broker, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            write()
+        return [(event_type, payload) for (event_type, payload), _ in publish.call_args_list]
+
+    def test_saves_are_published(self):
+        item = make_item()
+        item.status = 'retrieved'
+        [(event_type, payload)] = self.published(item.save)
+        self.assertEqual(event_type, 'status_changed')
+        self.assertEqual(payload['previous_status'], 'not_at_repository')
+
+    def test_admin_status_changes_are_published(self):
+        items = [make_item(), make_item(status='at_repository'), make_item(status='retrieved')]
+        modeladmin = mock.Mock()
+        published = self.published(lambda: lnf_admin._set_item_status(
+            modeladmin, None, Item.objects.all(), 'retrieved',
+        ))
+        self.assertEqual(
+            [(event_type, payload['id'], payload['status'], payload['previous_status']) for event_type, payload in published],
+            [
+                ('status_changed', items[0].pk, 'retrieved', 'not_at_repository'),
+                ('status_changed', items[1].pk, 'retrieved', 'at_repository'),
+            ],
+        )
+        self.assertEqual(published[0][1]['version'], items[0].version + 1)
+
+    def test_category_renames_are_published(self):
+        category = Category.objects.create(name='Bags')
+        item = make_item(category=category)
+        category.name = 'Backpacks'
+        published = self.published(category.save)
+        self.assertEqual(published, [('updated', mock.ANY)])
+        self.assertEqual(published[0][1]['id'], item.pk)
+        self.assertEqual(published[0][1]['category'], {'name': 'Backpacks', 'pending': False})
+
+    def test_stream_is_not_served_under_wsgi(self):
+        self.assertEqual(self.client.get(reverse('lnf:item_events')).status_code, 204)
+        self.assertNotContains(self.client.get(reverse('lnf:index')), 'new EventSource')
+
+    async def test_index_opens_the_stream_under_asgi(self):
+        response = await AsyncClient().get(reverse('lnf:index'))
+        self.assertContains(response, 'new EventSource')
+
+
+def png_header(width, height):
+    """The start of a PNG claiming the given size, cut off at its first bytes of pixel data."""
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack('>I', len(header)) + b'IHDR' + header
+    ihdr = chunk + struct.pack('>I', zlib.crc32(chunk[4:]))
+    pixels = zlib.compress(bytes(1024))
+    return b'\x89PNG\r\n\x1a\n' + ihdr + struct.pack('>I', len(pixels) * 1000) + b'IDAT' + pixels
+
+
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.incoming = os.path.join(media_root.name, 'item_images', '.incoming')
+        self.client.force_login(User.objects.create_user('uploader'))
+
+    def upload(self, content, name):
+        return self.client.post(reverse('lnf:upload'), {
+            'name': 'Poster',
+            'found_location': 'Library',
+            'found_date': timezone.localdate().isoformat(),
+            'category_name': 'Papers',
+            'image': SimpleUploadedFile(name, content),
+        })
+
+    def assertRejected(self, response, message):
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(message, response.context['form'].errors['image'][0])
+        self.assertEqual(os.listdir(self.incoming), [])
+        self.assertFalse(Item.objects.exists())
+
+    def test_decompression_bombs_are_rejected(self):
+        # Beyond what Pillow agrees to open at all
+        self.assertRejected(self.upload(png_header(20000, 20000), 'bomb.png'), 'at most 50 megapixels')
+
+    def test_large_images_are_rejected(self):
+        self.assertRejected(self.upload(png_header(8000, 8000), 'large.png'), 'at most 50 megapixels')
+
+    def test_large_images_that_are_decoded_whole_are_rejected(self):
+        self.assertRejected(self.upload(png_header(5000, 4000), 'large.png'), 'other than JPEGs')
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        # Rendered rows are cached by id and version, which other tests reuse
+        cache.clear()
+        self.items = [make_item(name=f'Item {number}') for number in range(4)]
+        # Written well before the token the client holds
+        Item.objects.update(change_seq=F('change_seq') - 60 * 1_000_000)
+        self.since = sync_token()
+
+    def sync(self, since=None):
+        response = self.client.get(reverse('lnf:items_api'), {'since': since or self.since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_responses_carry_a_token(self):
+        since = self.client.get(reverse('lnf:items_api')).json()['since']
+        self.assertAlmostEqual(int(since), next_change_seq() - SYNC_GRACE_US, delta=1_000_000)
+        self.assertEqual(parse_token(since), int(since))
+
+    def test_invalid_tokens(self):
+        for since in ('abc', '-1'):
+            with self.assertRaises(ValueError):
+                parse_token(since)
+            self.assertEqual(self.client.get(reverse('lnf:items_api'), {'since': since}).status_code, 404)
+
+    def test_nothing_changed(self):
+        data = self.sync()
+        self.assertEqual((data['changed'], data['removed']), ([], []))
+        self.assertGreaterEqual(int(data['since']), int(self.since))
+
+    def test_changes_after_the_token(self):
+        edited, deleted, retrieved, _ = self.items
+        edited.name = 'Blue umbrella'
+        edited.save()
+        added = make_item(name='Red cap')
+        deleted_id = deleted.pk
+        deleted.delete()
+        retrieved.status = 'retrieved'
+        retrieved.save()
+
+        data = self.sync()
+        self.assertEqual(sorted(data['changed']), [edited.pk, added.pk])
+        self.assertIn('Blue umbrella', data['html'])
+        # Deleted, and no longer matching the filters (retrieved items are hidden by default)
+        self.assertEqual(data['removed'], sorted([deleted_id, retrieved.pk]))
+        self.assertTrue(ItemTombstone.objects.filter(item_id=deleted_id).exists())
+
+    def test_recent_changes_are_sent_again_within_the_grace_window(self):
+        item = self.items[0]
+        item.save()
+        # The token is held back, so a write committing late is not missed
+        data = self.sync(sync_token())
+        self.assertEqual(data['changed'], [item.pk])
+        self.assertEqual(self.sync(data['since'])['changed'], [item.pk])
+
+    def test_expired_tokens_ask_for_a_reload(self):
+        since = str(next_change_seq() - TOMBSTONE_RETENTION_US - 1_000_000)
+        with self.assertRaises(SyncExpired):
+            parse_token(since)
+        self.assertEqual(self.sync(since), {'reset': True, 'since': mock.ANY})
+
+    def test_large_deltas_ask_for_a_reload(self):
+        with mock.patch('lnf.sync.SYNC_MAX_ROWS', 2), mock.patch('lnf.views.SYNC_MAX_ROWS', 2):
+            self.items[0].save()
+            self.assertFalse(self.sync().get('reset'))
+            Item.objects.filter(pk__in=[item.pk for item in self.items[1:]]).delete()
+            self.assertEqual(self.sync(), {'reset': True, 'since': mock.ANY})
+
+
+class JobQueueTests(TestCase):
+    def test_stale_jobs_are_requeued_until_their_last_attempt(self):
+        expired = timezone.now() - datetime.timedelta(seconds=LEASE_SECONDS + 1)
+        fields = {'task': 'lnf.images.generate_variants', 'status': 'running', 'locked_by': 'gone', 'locked_at': expired}
+        retried = Job.objects.create(attempts=1, max_attempts=3, **fields)
+        exhausted = Job.objects.create(attempts=3, max_attempts=3, **fields)
+        current = Job.objects.create(**{**fields, 'locked_at': timezone.now()})
+
+        with self.assertLogs('lnf.jobs', 'ERROR'):
+            self.assertEqual(requeue_stale(), 1)
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual((retried.status, retried.locked_by, retried.finished_at), ('queued', '', None))
+        self.assertEqual((exhausted.status, exhausted.locked_by), ('failed', ''))
+        self.assertIsNotNone(exhausted.finished_at)
+        self.assertIn('lease ran out', exhausted.last_error)
+        self.assertEqual(current.status, 'running')
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        # Few distinct dates and names, so pages end in the middle of ties
+        for number in range(11):
+            make_item(name=f'Item {number % 3}', found_date=today - datetime.timedelta(days=number % 2))
+        cls.user = User.objects.create_user('watcher')
+        cls.watched = set(Item.objects.order_by('pk').values_list('pk', flat=True)[2:6])
+        cls.user.held_items.add(*cls.watched)
+
+    def feed(self, user, sort_by):
+        request = RequestFactory().get('/', {'sort_by': sort_by})
+        request.user = user
+        return _filter_and_sort_items(request)[0]
+
+    def ordered(self, item_list):
+        """``item_list`` in full, in the order pages are read: ties broken by id."""
+        return list(item_list.order_by(*[f"{'-' if descending else ''}{field}" for field, descending in get_ordering(item_list)]))
+
+    def walk(self, page, page_size=3):
+        """Every row of every page, following the cursors."""
+        rows, cursor = [], None
+        while True:
+            items, cursor = page(cursor, page_size)
+            self.assertLessEqual(len(items), page_size)
+            rows += items
+            if cursor is None:
+                return rows
+
+    def test_cursors_round_trip(self):
+        values = [True, datetime.date(2024, 2, 29), 'Item 1', 42]
+        cursor = encode_cursor(values)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), [True, '2024-02-29', 'Item 1', 42])
+
+    def test_pages_cover_ties_exactly_once(self):
+        for sort_by in ('-found_date', 'found_date', 'name', '-name'):
+            with self.subTest(sort_by=sort_by):
+                item_list = self.feed(AnonymousUser(), sort_by)
+                rows = self.walk(lambda cursor, page_size: paginate(item_list, cursor, page_size))
+                self.assertEqual(rows, self.ordered(item_list))
+
+    def test_watched_items_come_first_across_pages(self):
+        watched = Q(pk__in=self.user.held_items.values('pk'))
+        for sort_by in ('-found_date', 'name'):
+            with self.subTest(sort_by=sort_by):
+                item_list = self.feed(self.user, sort_by)
+                rows = self.walk(lambda cursor, page_size: paginate_split(item_list, watched, cursor, page_size))
+                # The two reads of the split match the ordering of a single query
+                self.assertEqual(rows, self.ordered(item_list))
+                self.assertEqual({item.pk for item in rows[:len(self.watched)]}, self.watched)
+
+    def test_invalid_filters_keep_the_feed_ordering(self):
+        # More than a page, so the walk needs a cursor
+        Item.objects.bulk_create(
+            Item(name=f'Extra {number}', found_location='Library', pub_date=timezone.now(),
+                 found_date=timezone.localdate() - datetime.timedelta(days=number % 7))
+            for number in range(PAGE_SIZE)
+        )
+        self.client.force_login(self.user)
+        params = {'categories': 999999, 'format': 'json', 'fields': 'id'}
+        request = RequestFactory().get('/', params)
+        request.user = self.user
+        item_list, form = _filter_and_sort_items(request)
+        self.assertFalse(form.is_valid())
+
+        ids, cursor = [], None
+        while True:
+            response = self.client.get(reverse('lnf:items_api'), {**params, 'cursor': cursor} if cursor else params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [row[0] for row in data['items']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, [item.pk for item in self.ordered(item_list)])
+        self.assertEqual(set(ids[:len(self.watched)]), self.watched)
+
+    def test_invalid_cursors(self):
+        item_list = self.feed(AnonymousUser(), '-found_date')
+        for cursor in ('not base64!', encode_cursor({'a': 1}), encode_cursor(['2024-01-01']),
+                       encode_cursor(['not a date', 1])):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    paginate(item_list, cursor)
+                for view in ('lnf:index', 'lnf:items_api'):
+                    self.assertEqual(self.client.get(reverse(view), {'cursor': cursor}).status_code, 404)
+        with self.assertRaises(InvalidCursor):
+            paginate_split(self.feed(self.user, 'name'), Q(pk=0), encode_cursor(['yes', 'Item 1', 1]))
+
+
+class WatchingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('watcher')
+        self.other = User.objects.create_user('other')
+        self.items = [make_item(), make_item(), make_item()]
+
+    def watched(self):
+        return set(self.user.held_items.values_list('pk', flat=True))
+
+    def test_toggling_twice_restores_the_state(self):
+        item = self.items[0]
+        item.held_by.add(self.other)
+        self.assertEqual(toggle_watch(self.user, item.pk), (True, 2))
+        self.assertEqual(self.watched(), {item.pk})
+        self.assertEqual(toggle_watch(self.user, item.pk), (False, 1))
+        self.assertEqual(self.watched(), set())
+        self.assertEqual(list(item.held_by.all()), [self.other])
+
+    def test_toggling_a_missing_item(self):
+        self.assertIsNone(toggle_watch(self.user, 0))
+        self.assertEqual(self.watched(), set())
+
+    def test_set_watching_is_idempotent(self):
+        ids = [item.pk for item in self.items[:2]]
+        self.assertEqual(set_watching(self.user, ids + ids, watch=True), 2)
+        self.assertEqual(set_watching(self.user, ids, watch=True), 0)
+        self.assertEqual(set_watching(self.user, [self.items[2].pk, 0], watch=True), 1)
+        self.assertEqual(self.watched(), {item.pk for item in self.items})
+        self.assertEqual(set_watching(self.user, ids, watch=False), 2)
+        self.assertEqual(set_watching(self.user, ids, watch=False), 0)
+        self.assertEqual(self.watched(), {self.items[2].pk})
+
+    def test_changes_bump_the_watch_version(self):
+        version = user_watch_version(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            set_watching(self.user, [self.items[0].pk], watch=True)
+        self.assertNotEqual(user_watch_version(self.user), version)
+        version = user_watch_version(self.user)
+        # Nothing changed, so cached responses stay valid
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            set_watching(self.user, [self.items[0].pk], watch=True)
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_watch(self.user, self.items[0].pk)
+        self.assertNotEqual(user_watch_version(self.user), version)
+
+
+class ApprovePendingCategoriesTests(TestCase):
+    def setUp(self):
+        self.modeladmin = mock.Mock()
+        PendingCategory.objects.create(name='Umbrellas')
+        PendingCategory.objects.create(name='umbrellas ')
+        PendingCategory.objects.create(name='Toys')
+        self.items = [
+            make_item(pending_category_name='Umbrellas'),
+            make_item(pending_category_name='umbrellas '),
+            make_item(pending_category_name='Toys'),
+        ]
+        self.versions = {item.pk: item.version for item in self.items}
+
+    def approve(self, names, merge_variants):
+        generation = items_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            lnf_admin._approve_pending_categories(
+                self.modeladmin, None, PendingCategory.objects.filter(name__in=names), merge_variants,
+            )
+        self.assertNotEqual(items_generation(), generation)
+        for item in self.items:
+            item.refresh_from_db()
+
+    def test_approve(self):
+        self.approve(['Umbrellas'], merge_variants=False)
+        category = Category.objects.get(name='Umbrellas')
+        # iexact: the variant in case is moved, the one with a trailing space is not
+        self.assertEqual([item.category for item in self.items], [category, None, None])
+        self.assertIsNone(self.items[0].pending_category_name)
+        self.assertEqual(self.items[0].version, self.versions[self.items[0].pk] + 1)
+        self.assertEqual(self.items[2].version, self.versions[self.items[2].pk])
+        self.assertEqual(sorted(PendingCategory.objects.values_list('name', flat=True)), ['Toys', 'umbrellas '])
+        catalogue = get_catalogue()
+        self.assertIn('umbrellas', catalogue.id_by_lower)
+        self.assertNotIn('umbrellas', catalogue.pending_by_lower)
+
+    def test_approve_and_merge_variants(self):
+        existing = Category.objects.create(name='UMBRELLAS')
+        self.approve(['Umbrellas'], merge_variants=True)
+        # Folded into the existing category rather than creating another one
+        self.assertEqual(Category.objects.filter(name__iexact='umbrellas').count(), 1)
+        self.assertEqual([item.category for item in self.items], [existing, existing, None])
+        for item in self.items[:2]:
+            self.assertIsNone(item.pending_category_name)
+            self.assertEqual(item.version, self.versions[item.pk] + 1)
+        self.assertEqual(list(PendingCategory.objects.values_list('name', flat=True)), ['Toys'])
+        self.assertEqual(list(get_catalogue().pending_by_lower), ['toys'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.item = make_item()
+        self.user = User.objects.create_user('watcher')
+        self.client.force_login(self.user)
+
+    def get(self, etag=None, view='lnf:index'):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse(view), headers=headers)
+
+    def test_unchanged_lists_are_not_modified(self):
+        for view in ('lnf:index', 'lnf:items_api'):
+            with self.subTest(view=view):
+                etag = self.get(view=view)['ETag']
+                self.assertEqual(self.get(etag, view).status_code, 304)
+                # Other parameters are another list
+                response = self.client.get(reverse(view), {'sort_by': 'name'}, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+
+    def test_item_saves_change_the_etag(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.name = 'Blue umbrella'
+            self.item.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Blue umbrella')
+
+    def test_watching_changes_the_etag_of_the_watcher_only(self):
+        etag = self.get()['ETag']
+        other = User.objects.create_user('other')
+        other_client = self.client_class()
+        other_client.force_login(other)
+        other_etag = other_client.get(reverse('lnf:index'))['ETag']
+        self.assertNotEqual(etag, other_etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('lnf:toggle_watch_item', args=[self.item.pk]))
+        self.assertEqual(self.get(etag).status_code, 200)
+        response = other_client.get(reverse('lnf:index'), headers={'If-None-Match': other_etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_etag_while_messages_are_pending(self):
+        request = RequestFactory().get(reverse('lnf:index'))
+        request.user = self.user
+        request.session = self.client.session
+        request._messages = FallbackStorage(request)
+        self.assertIsNotNone(items_etag(request))
+        messages.success(request, 'Thank you for your honesty.')
+        self.assertIsNone(items_etag(request))
+        response = index(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'Thank you for your honesty.')
+
+
+class ItemRowFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.watcher = User.objects.create_user('watcher')
+        self.other = User.objects.create_user('other')
+        self.item = make_item(name='Black leather wallet', uploaded_by=self.owner)
+        self.item.held_by.add(self.watcher)
+
+    def render(self, user):
+        """The rows of the feed for ``user`` and how many row fragments had to be rendered."""
+        request = RequestFactory().get('/')
+        request.user = user
+        item_list, _ = _filter_and_sort_items(request)
+        with mock.patch('lnf.fragments.render_to_string', wraps=render_to_string) as render:
+            html = render_item_rows(item_list, 'list', request)
+        rendered = [call for call in render.call_args_list if call.args[0] == 'lnf/partials/_item_row.html']
+        for marker in (WATCH_CLASS_MARKER, ACTIONS_MARKER, str(PLACEHOLDER_ITEM_ID)):
+            self.assertNotIn(marker, html)
+        return html, len(rendered)
+
+    def test_cached_rows_are_patched_per_user(self):
+        watcher_html, rendered = self.render(self.watcher)
+        self.assertEqual(rendered, 1)
+        self.assertIn('class="item is-watched"', watcher_html)
+        self.assertIn('title="Unwatch Item"', watcher_html)
+        self.assertIn(reverse('lnf:toggle_watch_item', args=[self.item.pk]), watcher_html)
+
+        other_html, rendered = self.render(self.other)
+        # The same cached row, with the other user's watch state and actions
+        self.assertEqual(rendered, 0)
+        self.assertIn('class="item "', other_html)
+        self.assertIn('title="Watch Item"', other_html)
+        self.assertNotIn('Unwatch', other_html)
+
+        owner_html, _ = self.render(self.owner)
+        self.assertIn('title="My Uploads"', owner_html)
+        self.assertNotIn('Watch Item', owner_html)
+        anonymous_html, _ = self.render(AnonymousUser())
+        self.assertIn('Log in to watch this item', anonymous_html)
+
+    def test_saves_render_the_row_again(self):
+        self.render(self.other)
+        self.item.name = 'Blue umbrella'
+        self.item.save()
+        html, rendered = self.render(self.other)
+        self.assertEqual(rendered, 1)
+        self.assertIn('Blue umbrella', html)
+        self.assertNotIn('Black leather wallet', html)
+
+
+@mock.patch('lnf.metrics.SERVER_TIMING_PUBLIC', False)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.windows.clear()
+        self.addCleanup(metrics.windows.clear)
+        self.staff = User.objects.create_user('staff', is_staff=True)
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        make_item()
+        self.assertNotIn('Server-Timing', self.client.get(reverse('lnf:index')))
+        self.client.force_login(self.staff)
+        timing = self.client.get(reverse('lnf:index'))['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+;desc="templates", total;dur=[\d.]+$')
+
+    def test_requests_are_counted_per_endpoint(self):
+        self.client.get(reverse('lnf:index'))
+        self.client.get(reverse('lnf:index'))
+        self.client.get(reverse('lnf:items_api'))
+        self.client.force_login(self.staff)
+        endpoints = self.client.get(reverse('lnf:metrics')).json()['endpoints']
+        self.assertEqual(endpoints['GET lnf:index']['count'], 2)
+        self.assertEqual(endpoints['GET lnf:items_api']['count'], 1)
+        self.assertEqual(endpoints['GET lnf:index']['histogram']['le_inf'], 2)
+        self.assertGreater(endpoints['GET lnf:index']['mean_queries'], 0)
+
+    def test_metrics_are_for_staff_only(self):
+        response = self.client.get(reverse('lnf:metrics'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login/', response['Location'])
+
+    def test_slow_requests_log_warnings(self):
+        with mock.patch('lnf.metrics.SLOW_REQUEST_MS', 0), self.assertLogs('lnf.metrics', 'WARNING') as logs:
+            self.client.get(reverse('lnf:index'))
+        [record] = logs.records
+        self.assertEqual(record.levelname, 'WARNING')
+        self.assertEqual(json.loads(record.getMessage())['endpoint'], 'GET lnf:index')
+        with mock.patch('lnf.metrics.SLOW_REQUEST_MS', 60_000), self.assertLogs('lnf.metrics', 'INFO') as logs:
+            self.client.get(reverse('lnf:index'))
+        self.assertEqual([record.levelname for record in logs.records], ['INFO'])
+
+
+class ItemRowFormatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_json_rows_and_events_show_dates_like_the_html_rows(self):
+        item = make_item(found_date=datetime.date(2026, 10, 7))
+        html = self.client.get(reverse('lnf:items_api')).json()['html']
+        self.assertIn('<div>Oct. 7, 2026</div>', html)
+        data = self.client.get(reverse('lnf:items_api'), {'format': 'json', 'fields': 'found_date,found_on'}).json()
+        self.assertEqual(data['items'], [['2026-10-07', 'Oct. 7, 2026']])
+        self.assertEqual(item_payload(Item.objects.select_related('category').get()), {
+            **item_payload(item), 'found_on': 'Oct. 7, 2026',
+        })
+
+
+class CompressedStaticFilesTests(TestCase):
+    CSS = ''.join(f'.item-{number} {{ margin: {number}px; }}\n' for number in range(200))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source, root = os.path.join(directory.name, 'static'), os.path.join(directory.name, 'root')
+        for name, content in (('css/site.css', self.CSS), ('vendor/keep.js', 'keep();'), ('vendor/drop.js', 'drop();')):
+            os.makedirs(os.path.dirname(os.path.join(source, name)), exist_ok=True)
+            with open(os.path.join(source, name), 'w') as file:
+                file.write(content)
+        self.enterContext(override_settings(
+            STATICFILES_DIRS=[source], STATIC_ROOT=root, LNF_STATIC_VENDOR_FILES={'vendor': ['vendor/keep.js']},
+        ))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed_name = staticfiles_storage.stored_name('css/site.css')
+        # A new client, so the middleware is set up with the collected files
+        self.client = self.client_class()
+
+    def get(self, name, **headers):
+        return self.client.get(f'/static/{name}', headers=headers)
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_gzip_copies_for_clients_that_accept_them(self):
+        self.assertNotEqual(self.hashed_name, 'css/site.css')
+        response = self.get(self.hashed_name, accept_encoding='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(self.content(response)).decode(), self.CSS)
+
+    def test_identity_when_gzip_is_refused(self):
+        for accept_encoding in ('gzip;q=0', 'gzip; q=0.0, identity', '*;q=0', ''):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get(self.hashed_name, accept_encoding=accept_encoding)
+                self.assertNotIn('Content-Encoding', response)
+                self.assertEqual(self.content(response).decode(), self.CSS)
+        self.assertEqual(self.get(self.hashed_name, accept_encoding='*')['Content-Encoding'], 'gzip')
+
+    def test_only_hashed_names_are_immutable(self):
+        self.assertEqual(self.get(self.hashed_name)['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(self.get('css/site.css')['Cache-Control'], MUTABLE_CACHE_CONTROL)
+
+    def test_not_modified_since(self):
+        last_modified = self.get(self.hashed_name)['Last-Modified']
+        response = self.get(self.hashed_name, if_modified_since=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_pruned_vendor_files_are_not_served(self):
+        self.assertEqual(self.get('vendor/keep.js').status_code, 200)
+        self.assertEqual(self.get('vendor/drop.js').status_code, 404)
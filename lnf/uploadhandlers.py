@@ -0,0 +1,176 @@
+"""
+Upload handler for item images.
+
+The image is streamed to a temporary file inside the media directory, so
+that storing it afterwards is a rename rather than a copy. Uploads over the
+byte cap, or whose header declares more pixels than allowed, are dropped as
+soon as that is known. Once complete, the image is re-encoded in a single
+pass that applies the EXIF orientation, drops the EXIF data (GPS location
+included) and downscales it to LNF_UPLOAD_MAX_DIMENSION. JPEGs are decoded
+at reduced scale, so the full-size bitmap is never held in memory; other
+formats can only be decoded whole, so they get the lower
+LNF_UPLOAD_MAX_DECODED_PIXELS cap.
+"""
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+MAX_BYTES = getattr(settings, 'LNF_UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+MAX_PIXELS = getattr(settings, 'LNF_UPLOAD_MAX_PIXELS', 50_000_000)
+# PNG, WebP, GIF... are decoded at full size (4 bytes a pixel in RGBA) before downscaling
+MAX_DECODED_PIXELS = getattr(settings, 'LNF_UPLOAD_MAX_DECODED_PIXELS', 16_000_000)
+MAX_DIMENSION = getattr(settings, 'LNF_UPLOAD_MAX_DIMENSION', 2560)
+# How much of the file may be read while looking for a complete image header
+MAX_HEADER_BYTES = 256 * 1024
+
+INVALID_IMAGE_MESSAGE = 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.'
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85},
+}
+
+
+class StreamedImageFile(UploadedFile):
+    """An uploaded image stored in a temporary file that the storage can move into place."""
+
+    def __init__(self, path, name, content_type, size):
+        super().__init__(open(path, 'rb'), name, content_type, size)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            # Gone already if the storage moved it into place
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class ItemImageUploadHandler(FileUploadHandler):
+    field_name = 'image'
+    incoming_dir = 'item_images/.incoming'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.file = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name != self.field_name:
+            return
+        if content_length and content_length > MAX_BYTES:
+            self._reject(f'The image must be smaller than {filesizeformat(MAX_BYTES)}.')
+
+        directory = os.path.join(settings.MEDIA_ROOT, self.incoming_dir)
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, suffix='.upload', delete=False)
+        self.size = 0
+        self.header = BytesIO()
+        self.header_checked = False
+        self.active = True
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.size += len(raw_data)
+        if self.size > MAX_BYTES:
+            self._reject(f'The image must be smaller than {filesizeformat(MAX_BYTES)}.')
+        if not self.header_checked:
+            self._check_header(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        self.file.close()
+        content_type, name = self.content_type, self.file_name
+        if self.header_checked:
+            try:
+                content_type, extension = self._reencode(self.file.name)
+                name = os.path.splitext(self.file_name)[0] + extension
+            except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+                # Hand over the file as received; the form's image validation rejects it
+                pass
+        return StreamedImageFile(self.file.name, name, content_type, os.path.getsize(self.file.name))
+
+    def upload_interrupted(self):
+        if self.active:
+            self.active = False
+            self._discard()
+
+    def _check_header(self, data):
+        """Read the image size from the header as soon as enough bytes have arrived."""
+        self.header.write(data)
+        try:
+            with Image.open(BytesIO(self.header.getvalue())) as image:
+                width, height = image.size
+                source_format = image.format
+        except Image.DecompressionBombError:
+            # Pillow refuses to even open images of more than twice its own pixel limit
+            self._reject(f'The image must have at most {MAX_PIXELS // 1_000_000} megapixels.')
+        except (UnidentifiedImageError, OSError, SyntaxError):
+            if self.header.tell() > MAX_HEADER_BYTES:
+                self._reject(INVALID_IMAGE_MESSAGE)
+            return
+        self.header_checked = True
+        self.header = None
+        if width * height > MAX_PIXELS:
+            self._reject(f'The image must have at most {MAX_PIXELS // 1_000_000} megapixels.')
+        if source_format != 'JPEG' and width * height > MAX_DECODED_PIXELS:
+            self._reject(
+                f'Images other than JPEGs must have at most {MAX_DECODED_PIXELS // 1_000_000} megapixels.'
+            )
+
+    def _reencode(self, path):
+        """Orient, strip and downscale the image in one decode/encode pass; return its type and extension."""
+        with Image.open(path) as image:
+            source_format = image.format
+            if getattr(image, 'is_animated', False):
+                # Keep animations untouched; they are small enough once under the caps
+                return Image.MIME.get(source_format, 'image/gif'), '.' + source_format.lower()
+            # Let the JPEG decoder scale down by a power of two while decoding
+            image.draft('RGB', (MAX_DIMENSION, MAX_DIMENSION))
+            oriented = ImageOps.exif_transpose(image)
+            oriented.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+
+            target_format = source_format if source_format in SAVE_OPTIONS else 'PNG'
+            if target_format == 'JPEG' and oriented.mode not in ('RGB', 'L'):
+                oriented = oriented.convert('RGB')
+            temporary_path = path + '.tmp'
+            # No exif= argument: the metadata is not written back out
+            oriented.save(temporary_path, target_format, **SAVE_OPTIONS[target_format])
+        os.replace(temporary_path, path)
+        extension = '.jpg' if target_format == 'JPEG' else '.' + target_format.lower()
+        return Image.MIME[target_format], extension
+
+    def _discard(self):
+        if getattr(self, 'file', None) is None:
+            return
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+    def _set_error(self, message):
+        if self.request is not None:
+            self.request.image_upload_error = message
+
+    def _reject(self, message):
+        self.active = False
+        self._discard()
+        self._set_error(message)
+        raise SkipFile(message)
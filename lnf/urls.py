@@ -8,8 +8,10 @@ urlpatterns = [
     path("", views.full_info, name="landing"),
     path("home/", views.index, name="index"),
     path('api/items/', views.items_api, name='items_api'),
+    path('api/items/events/', views.item_events, name='item_events'),
     path("upload/", views.upload, name="upload"),
     path("profile/", views.profile, name="profile"),
+    path("profile/notifications/read/", views.mark_notifications_read, name="mark_notifications_read"),
     path('about/', views.about, name='about'),
     path('features/', views.features, name='features'),
     path('contact/', views.contact, name='contact'),
@@ -18,6 +20,8 @@ urlpatterns = [
     path("login/", views.Login.as_view(), name="login"), # Custom Login View
     path('logout/', auth_views.LogoutView.as_view(next_page='lnf:landing'), name='logout'),
     path("item/<int:item_id>/toggle_watch/", views.toggle_watch_item, name="toggle_watch_item"),
+    path('item/watch/bulk/', views.bulk_watch_items, name='bulk_watch_items'),
     path('item/<int:item_id>/delete/', views.delete_item, name='delete_item'),
     path('go_to_my_uploads/', views.go_to_my_uploads, name='go_to_my_uploads'),
+    path('metrics/', views.request_metrics, name='metrics'),
 ]
@@ -1,22 +1,62 @@
+import contextlib
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib import messages
-from django.db.models import Q, Case, When, Value, BooleanField
+from django.db.models import Exists, OuterRef, Q
 from django.db.models.functions import Lower
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.template.loader import render_to_string
 from django.contrib.auth.views import LoginView
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import condition, require_POST
 
-from .models import Category, Item, PendingCategory
+from . import events, metrics
+from .caching import (
+    ITEMS_CACHE_TIMEOUT, filter_signature, items_etag, items_last_modified, items_response_key,
+)
+from .catalogue import get_catalogue
+from .facets import get_facets
+from .models import Item, PendingCategory
+from .images import schedule_variants
 from .forms import ItemForm, SignUpForm, ItemFilterForm, LoginForm # Import LoginForm
+from .routers import primary_reads, reads_from_replica
+from .pagination import InvalidCursor, get_ordering, paginate, paginate_split
+from .search import search_items
+from .sqlite import serialized_write
+from .serializers import parse_fields, serialize_rows, values_for
+from .sync import SYNC_MAX_ROWS, SyncExpired, changes_since, parse_token, sync_token
+from .uploadhandlers import ItemImageUploadHandler
+from .watching import set_watching, toggle_watch
+
+# Largest number of items one bulk watch request may change
+BULK_WATCH_LIMIT = 500
+
+def _with_watch_state(item_list, user):
+    """
+    Annotate ``is_held_by_user`` with an EXISTS lookup on the watch table, so
+    neither the M2M join (and its DISTINCT) nor a prefetch of every watcher
+    is needed to tell whether the current user watches an item.
+    """
+    if not user.is_authenticated:
+        return item_list
+    return item_list.annotate(
+        is_held_by_user=Exists(
+            Item.held_by.through.objects.filter(item_id=OuterRef('pk'), user_id=user.pk)
+        )
+    )
 
-def _filter_and_sort_items(request):
+def _filter_and_sort_items(request, form=None):
     """Helper function to filter and sort items based on form data."""
-    item_list = Item.objects.all().select_related('category').prefetch_related('held_by')
+    item_list = Item.objects.all().select_related('category')
     # We pass the data to the form for validation and cleaning
-    form = ItemFilterForm(request.GET)
+    if form is None:
+        form = ItemFilterForm(request.GET)
 
     if form.is_valid():
         query = form.cleaned_data.get('q')
@@ -28,96 +68,244 @@ def _filter_and_sort_items(request):
         if not include_retrieved:
             item_list = item_list.exclude(status='retrieved')
 
-        if query:
-            item_list = item_list.filter(
-                Q(name__icontains=query) | 
-                Q(found_location__icontains=query) |
-                Q(pending_category_name__icontains=query)
-            )
-        
         if categories:
-            item_list = item_list.filter(category__in=categories)
+            # Selecting a category includes everything filed under its subcategories
+            item_list = item_list.filter(category_id__in=get_catalogue().descendant_ids(categories))
 
         if found_date:
             item_list = item_list.filter(found_date=found_date)
+
+        # Search last, so the fuzzy fallback only kicks in when nothing
+        # matches the query within the other filters
+        if query:
+            # Matches come from the full-text index, ranked in `search_rank`
+            item_list = search_items(item_list, query)
         
-        sort_order = sort_by if sort_by else '-found_date'
+        sort_order = sort_by if sort_by else 'relevance'
+        if sort_order == 'relevance':
+            # Best matches first while searching, newest finds otherwise
+            sort_order = '-search_rank' if query else '-found_date'
 
         # Annotate with a boolean indicating if the item is held by the current user
         # This allows sorting held items first without separate queries
-        if request.user.is_authenticated:
-            item_list = item_list.annotate(
-                is_held_by_user=Case(
-                    When(held_by=request.user, then=Value(True)),
-                    default=Value(False),
-                    output_field=BooleanField()
-                )
-            )
-
-
-        # Determine the ordering expression for case-insensitive sorting
-        if sort_order == 'name':
-            order_expression = Lower('name')
-        elif sort_order == '-name':
-            order_expression = Lower('name').desc()
-        else:
-            order_expression = sort_order
+        item_list = _with_watch_state(item_list, request.user)
+
+
+        # Sort case-insensitively by name through an annotation so the ordering
+        # stays a plain field name that keyset pagination can compare against.
+        if sort_order in ('name', '-name'):
+            item_list = item_list.annotate(name_lower=Lower('name'))
+            sort_order = sort_order.replace('name', 'name_lower')
 
         # Apply the secondary sort order after prioritizing held items
         if request.user.is_authenticated:
-            item_list = item_list.order_by('-is_held_by_user', order_expression)
+            item_list = item_list.order_by('-is_held_by_user', sort_order)
+        else:
+            item_list = item_list.order_by(sort_order)
+    else:
+        # Same default ordering as a valid form without filters, watched items first
+        item_list = _with_watch_state(item_list, request.user)
+        if request.user.is_authenticated:
+            item_list = item_list.order_by('-is_held_by_user', '-found_date')
         else:
-            item_list = item_list.order_by(order_expression)
+            item_list = item_list.order_by('-found_date')
     
-    return item_list.distinct(), form
+    return item_list, form
 
+def _paginate_items(request, item_list):
+    """Return the page of items after the ``cursor`` GET parameter and the next cursor."""
+    cursor = request.GET.get('cursor')
+    try:
+        if get_ordering(item_list)[0][0] == 'is_held_by_user':
+            # Watched items come first (see _filter_and_sort_items): read them
+            # from the watch table and the rest off the feed indexes
+            watched = Q(pk__in=Item.held_by.through.objects.filter(user_id=request.user.pk).values('item_id'))
+            return paginate_split(item_list, watched, cursor)
+        return paginate(item_list, cursor)
+    except InvalidCursor:
+        raise Http404("Invalid cursor.")
+
+@reads_from_replica
+@cache_control(no_cache=True)
+@condition(etag_func=items_etag, last_modified_func=items_last_modified)
 def index(request):
-    """Main view to display the filter form and the list of items."""
+    """Main view to display the filter form and the first page of items."""
     item_list, form = _filter_and_sort_items(request)
+    items, next_cursor = _paginate_items(request, item_list)
     view_type = request.GET.get('viewMode', 'list') # Get viewMode from URL param or default
     context = {
         'form': form,
-        'item_list': item_list,
+        'item_list': items,
+        'next_cursor': next_cursor,
+        'since': sync_token(),
         'view_type': view_type,
+        'status_labels': dict(Item.STATUS_CHOICES),
+        'event_stream': events.streaming_supported(request),
     }
     return render(request, 'lnf/index.html', context)
 
+@reads_from_replica
+@cache_control(no_cache=True)
+@condition(etag_func=items_etag, last_modified_func=items_last_modified)
 def items_api(request):
-    """API endpoint to fetch filtered and sorted items as HTML."""
-    item_list, _ = _filter_and_sort_items(request)
+    """
+    API endpoint to fetch one page of filtered and sorted items as HTML.
+    Pages after the first (requested with a ``cursor``) only contain the item
+    rows so the client can append them to the list it already shows.
+    With ``format=json`` the items are sent as compact rows of the fields
+    listed in ``fields`` instead, for the page to render itself.
+    With ``facets=1`` the response also carries the filter facet counts.
+    Every response has a ``since`` token; passing it back as ``since`` only
+    returns the changes after it (see _item_changes).
+    Responses for anonymous users are the same for everyone and are shared
+    through the cache until the next item or category write.
+    """
+    form = ItemFilterForm(request.GET)
     view_type = request.GET.get('viewMode', 'list') # Get viewMode from AJAX request
-    # We need the request object in the template for user-specific logic (e.g., hold/unhold buttons)
-    html = render_to_string('lnf/partials/_item_list.html', {'item_list': item_list, 'view_type': view_type}, request=request)
-    return JsonResponse({'html': html})
+    cursor = request.GET.get('cursor')
+    want_facets = request.GET.get('facets') == '1'
+    as_json = request.GET.get('format') == 'json'
+    fields = parse_fields(request.GET.get('fields')) if as_json else None
+    # Taken before reading, so nothing written meanwhile falls before it
+    since = sync_token()
+
+    if request.GET.get('since'):
+        item_list, _ = _filter_and_sort_items(request, form)
+        return JsonResponse(_item_changes(request, item_list, view_type, fields, since))
 
+    cache_key = None
+    if not request.user.is_authenticated and form.is_valid():
+        signature = filter_signature(form, view_type=view_type, cursor=cursor, facets=want_facets, fields=fields)
+        cache_key = items_response_key(signature)
+        data = cache.get(cache_key)
+        if data is not None:
+            return JsonResponse(data)
 
+    with primary_reads() if cache_key else contextlib.nullcontext():
+        data = _items_page(request, form, view_type, cursor, fields)
+    data['since'] = since
+    if want_facets and form.is_valid():
+        data['facets'] = get_facets(form)
+    if cache_key:
+        cache.set(cache_key, data, ITEMS_CACHE_TIMEOUT)
+    return JsonResponse(data)
+
+def _items_page(request, form, view_type, cursor, fields):
+    item_list, _ = _filter_and_sort_items(request, form)
+    if fields is not None:
+        ordering_fields = [field for field, _ in get_ordering(item_list)]
+        rows, next_cursor = _paginate_items(request, values_for(item_list, fields, ordering_fields))
+        data = {'fields': fields, 'items': serialize_rows(rows, fields, request.user), 'next_cursor': next_cursor}
+    else:
+        items, next_cursor = _paginate_items(request, item_list)
+        template_name = 'lnf/partials/_item_rows.html' if cursor else 'lnf/partials/_item_list.html'
+        # We need the request object in the template for user-specific logic (e.g., hold/unhold buttons)
+        html = render_to_string(template_name, {'item_list': items, 'view_type': view_type}, request=request)
+        data = {'html': html, 'next_cursor': next_cursor}
+    return data
 
+def _item_changes(request, item_list, view_type, fields, since):
+    """
+    The delta after the ``since`` GET parameter: ``changed`` lists the ids of
+    new or updated items matching the filters, whose rows follow (as HTML
+    rows or, with ``fields``, as JSON rows); ``removed`` lists the ids to drop.
+    ``reset`` asks the client to reload the whole list instead.
+    """
+    try:
+        changed, removed = changes_since(item_list, parse_token(request.GET['since']))
+    except SyncExpired:
+        return {'reset': True, 'since': since}
+    except ValueError:
+        raise Http404("Invalid sync token.")
+    if len(removed) > SYNC_MAX_ROWS:
+        return {'reset': True, 'since': since}
+
+    if fields is not None:
+        rows = list(values_for(changed, fields, ['id'])[:SYNC_MAX_ROWS + 1])
+    else:
+        rows = list(changed[:SYNC_MAX_ROWS + 1])
+    if len(rows) > SYNC_MAX_ROWS:
+        return {'reset': True, 'since': since}
+
+    data = {'since': since, 'removed': removed}
+    if fields is not None:
+        data['changed'] = [row['id'] for row in rows]
+        data['fields'] = fields
+        data['items'] = serialize_rows(rows, fields, request.user)
+    else:
+        data['changed'] = [item.pk for item in rows]
+        data['html'] = render_to_string(
+            'lnf/partials/_item_rows.html', {'item_list': rows, 'view_type': view_type}, request=request,
+        )
+    return data
+
+
+async def item_events(request):
+    """
+    Server-sent event stream of item changes (see lnf.events). Meant to be
+    served by the ASGI application, where an open stream doesn't hold a thread;
+    under WSGI it answers 204, which tells EventSource not to reconnect.
+    """
+    if not events.streaming_supported(request):
+        return HttpResponse(status=204)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or 0)
+    except ValueError:
+        last_event_id = 0
+    response = StreamingHttpResponse(events.stream(last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx and similar proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
 @login_required
 def upload(request):
+    # The image handler must be installed before anything reads request.POST,
+    # which is why CSRF protection moves to the inner view.
+    request.upload_handlers.insert(0, ItemImageUploadHandler(request))
+    return _upload(request)
+
+@csrf_protect
+def _upload(request):
     # Pass the list of approved categories for the datalist
-    category_list = Category.objects.all()
+    catalogue = get_catalogue()
+    category_list = catalogue.sorted_by_name()
     
     if request.method == 'POST':
         form = ItemForm(request.POST, request.FILES, user=request.user)
-        if form.is_valid():
+        upload_error = getattr(request, 'image_upload_error', None)
+        if upload_error:
+            # The handler dropped the image; say why instead of "This field is required."
+            form.is_valid()
+            form.errors['image'] = form.error_class([upload_error])
+        elif form.is_valid():
             item = form.save(commit=False)
             item.pub_date = timezone.now()
             item.uploaded_by = request.user
 
-            category_name = form.cleaned_data['category_name'].strip()
-            try:
-                # Check if an approved category already exists.
-                category = Category.objects.get(name__iexact=category_name)
-                item.category = category
-            except Category.DoesNotExist:
-                # If not, find or create a pending category.
-                pending_category, _ = PendingCategory.objects.get_or_create(
-                    name__iexact=category_name, 
-                    defaults={'name': category_name}
-                )
-                item.pending_category_name = pending_category.name
+            # One write transaction for the pending category, the item and its image job
+            with serialized_write():
+                category_name = form.cleaned_data['category_name'].strip()
+                category_id = catalogue.id_by_lower.get(category_name.lower())
+                if category_id is not None:
+                    # An approved category already exists.
+                    item.category_id = category_id
+                elif category_name.lower() in catalogue.pending_by_lower:
+                    # Reuse the spelling of the pending category that is already waiting for approval.
+                    item.pending_category_name = catalogue.pending_by_lower[category_name.lower()]
+                else:
+                    # If not, find or create a pending category.
+                    pending_category, _ = PendingCategory.objects.get_or_create(
+                        name__iexact=category_name, 
+                        defaults={'name': category_name}
+                    )
+                    item.pending_category_name = pending_category.name
             
-            item.save()
+                item.save()
+                # Resized copies are made in the background; the response doesn't wait for them
+                schedule_variants(item)
             messages.success(request, 'Thank you for your honesty. Please proceed to the Liceo Prefect Office to surrender the item.')
             return redirect('lnf:index')
     else:
@@ -150,29 +338,50 @@ class Login(LoginView):
             self.request.session.set_expiry(0)  # Expire session on browser close
         return super().form_valid(form)
 
+@reads_from_replica
 @login_required
 def profile(request):
-    uploaded_items = request.user.uploaded_items.all()
-    watched_items = request.user.held_items.all()
+    uploaded_items = _with_watch_state(request.user.uploaded_items.select_related('category'), request.user)
+    watched_items = _with_watch_state(request.user.held_items.select_related('category'), request.user)
+    notifications = request.user.notifications.filter(read_at__isnull=True).select_related('item')
     context = {
         'uploaded_items': uploaded_items,
         'watched_items': watched_items,
+        'notifications': notifications,
     }
     return render(request, 'lnf/profile.html', context)
 
-from django.views.decorators.csrf import csrf_protect
+@login_required
+@require_POST
+def mark_notifications_read(request):
+    request.user.notifications.filter(read_at__isnull=True).update(read_at=timezone.now())
+    return redirect('lnf:profile')
 
 @csrf_protect
 @login_required
 def toggle_watch_item(request, item_id):
-    item = get_object_or_404(Item, pk=item_id)
-    if request.user in item.held_by.all():
-        item.held_by.remove(request.user)
-        watched = False
-    else:
-        item.held_by.add(request.user)
-        watched = True
-    return JsonResponse({'status': 'ok', 'watched': watched})
+    result = toggle_watch(request.user, item_id)
+    if result is None:
+        raise Http404("No item matches the given query.")
+    watched, watchers = result
+    return JsonResponse({'status': 'ok', 'watched': watched, 'watchers': watchers})
+
+@csrf_protect
+@login_required
+@require_POST
+def bulk_watch_items(request):
+    """Watch (``action=watch``) or unwatch (``action=unwatch``) every item in ``ids``."""
+    action = request.POST.get('action')
+    try:
+        item_ids = [int(item_id) for item_id in request.POST.getlist('ids')]
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Item ids must be numbers.'}, status=400)
+    if action not in ('watch', 'unwatch') or not item_ids:
+        return JsonResponse({'status': 'error', 'message': 'Give an action and at least one item id.'}, status=400)
+    if len(item_ids) > BULK_WATCH_LIMIT:
+        return JsonResponse({'status': 'error', 'message': f'At most {BULK_WATCH_LIMIT} items at a time.'}, status=400)
+    changed = set_watching(request.user, item_ids, watch=action == 'watch')
+    return JsonResponse({'status': 'ok', 'changed': changed})
 
 @login_required
 def delete_item(request, item_id):
@@ -186,6 +395,11 @@ def delete_item(request, item_id):
 def go_to_my_uploads(request):
     return redirect('lnf:profile')
 
+@staff_member_required
+def request_metrics(request):
+    """Rolling per-endpoint request timings of this process (see lnf.metrics)."""
+    return JsonResponse({'window': metrics.WINDOW, 'endpoints': metrics.windows.snapshot()})
+
 def about(request):
     return render(request, 'lnf/info/about.html')
 
@@ -0,0 +1,76 @@
+"""
+Watching items: writes straight to the ``Item.held_by`` through table.
+
+Neither the item nor its watchers are loaded. A toggle first deletes the
+user's watch row; if there was none it inserts one, guarded by the item's
+existence and the table's unique constraint, so concurrent clicks cannot
+create duplicates. Bulk changes are a single INSERT ... SELECT or DELETE.
+These statements bypass ``m2m_changed``, so the watch version of the user
+is bumped here (see lnf.caching).
+"""
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+
+from .caching import bump_user_watch_version
+from .models import Item
+from .sqlite import serialized_write
+
+Watch = Item.held_by.through
+
+
+def _insert_watches(user_id, item_ids):
+    """Insert watch rows for the existing items among ``item_ids``; return how many were added."""
+    if not item_ids:
+        return 0
+    ops = connection.ops
+    item_column = ops.quote_name(Watch._meta.get_field('item').column)
+    user_column = ops.quote_name(Watch._meta.get_field('user').column)
+    item_pk = ops.quote_name(Item._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(item_ids))
+    sql = (
+        f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {ops.quote_name(Watch._meta.db_table)} '
+        f'({item_column}, {user_column}) '
+        f'SELECT {item_pk}, %s FROM {ops.quote_name(Item._meta.db_table)} WHERE {item_pk} IN ({placeholders}) '
+        f'{ops.on_conflict_suffix_sql([], OnConflict.IGNORE, None, None)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, *item_ids])
+        return cursor.rowcount
+
+
+def _bump_on_commit(user_id):
+    transaction.on_commit(lambda: bump_user_watch_version(user_id))
+
+
+def toggle_watch(user, item_id):
+    """
+    Flip whether ``user`` watches the item; return the new state and the
+    item's watcher count, or None if there is no such item.
+    """
+    with serialized_write():
+        removed = Watch.objects.filter(item_id=item_id, user_id=user.pk).delete()[0]
+        if removed:
+            watched = False
+        elif _insert_watches(user.pk, [item_id]):
+            watched = True
+        elif Item.objects.filter(pk=item_id).exists():
+            # Watched by a concurrent request in the meantime
+            watched = True
+        else:
+            return None
+        watchers = Watch.objects.filter(item_id=item_id).count()
+        _bump_on_commit(user.pk)
+    return watched, watchers
+
+
+def set_watching(user, item_ids, watch):
+    """Watch or unwatch all of ``item_ids`` in one statement; return how many rows changed."""
+    item_ids = sorted(set(item_ids))
+    with serialized_write():
+        if watch:
+            changed = _insert_watches(user.pk, item_ids)
+        else:
+            changed = Watch.objects.filter(user_id=user.pk, item_id__in=item_ids).delete()[0]
+        if changed:
+            _bump_on_commit(user.pk)
+    return changed
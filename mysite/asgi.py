@@ -3,6 +3,14 @@ ASGI config for mysite project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the site through it (e.g. ``uvicorn mysite.asgi:application``) so the
+item event stream at /api/items/events/ runs on the event loop instead of
+holding a thread per open connection. The index page only opens the stream
+when it was itself served through ASGI: under WSGI (runserver, gunicorn sync
+workers) the endpoint answers 204 and open pages catch up when they become
+visible again. Use a single worker process: events are published in-process
+(see lnf.events).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
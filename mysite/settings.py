@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,11 +52,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Answers static file requests before anything else runs (see lnf.staticfiles)
+    'lnf.staticfiles.CompressedStaticFilesMiddleware',
+    # Early, so it times everything below it (see lnf.metrics)
+    'lnf.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'lnf.routers.PinPrimaryAfterWriteMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +70,8 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing renders for the request metrics
+        'BACKEND': 'lnf.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,13 +90,101 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# LNF_DB_ENGINE picks the database: 'sqlite' (default, the db.sqlite3 file,
+# tuned for concurrent use unless LNF_SQLITE_TUNING=0) or 'postgres', configured from the POSTGRES_* variables and requiring the
+# psycopg package. With POSTGRES_REPLICA_HOST set, the read-heavy item views
+# read from that replica, see lnf/routers.py.
+
+def _postgres(host):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'lnf'),
+        'USER': os.environ.get('POSTGRES_USER', 'lnf'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': host,
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Reuse connections across requests, checking them before each request
+        'CONN_MAX_AGE': int(os.environ.get('LNF_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if os.environ.get('LNF_DB_POOL') == '1':
+        # psycopg's connection pool (requires psycopg[pool]); replaces persistent connections
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('LNF_DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('LNF_DB_POOL_MAX', 10)),
+        }
+    return database
+
+if os.environ.get('LNF_DB_ENGINE', 'sqlite') == 'postgres':
+    DATABASES = {'default': _postgres(os.environ.get('POSTGRES_HOST', 'localhost'))}
+    if os.environ.get('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = _postgres(os.environ['POSTGRES_REPLICA_HOST'])
+        # Tests run against the primary only
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # A file rather than memory, so tests see the real locking behaviour. It
+            # goes in the temporary directory, named per process so that concurrent
+            # runs don't share it; set LNF_TEST_DATABASE to a fixed path for --keepdb.
+            'TEST': {'NAME': os.environ.get('LNF_TEST_DATABASE') or os.path.join(
+                tempfile.gettempdir(), f'lnf-test-{os.getpid()}.sqlite3',
+            )},
+        }
+    }
+    if os.environ.get('LNF_SQLITE_TUNING', '1') == '1':
+        DATABASES['default']['OPTIONS'] = {
+            # Take the write lock when a transaction starts instead of on its
+            # first write, where SQLite can only fail instead of waiting
+            'transaction_mode': 'IMMEDIATE',
+            # Seconds to wait for the write lock (the busy timeout)
+            'timeout': 20,
+            'init_command': ';'.join([
+                # Readers don't block on the writer and vice versa
+                'PRAGMA journal_mode=WAL',
+                # Safe with WAL; only skips the fsync on every commit
+                'PRAGMA synchronous=NORMAL',
+                'PRAGMA mmap_size=268435456',
+                'PRAGMA cache_size=-20000',
+                'PRAGMA temp_store=MEMORY',
+            ]),
+        }
+
+# Serialize the app's write transactions within the process, see lnf/sqlite.py
+LNF_SQLITE_WRITE_LOCK = os.environ.get('LNF_SQLITE_WRITE_LOCK') == '1'
+
+DATABASE_ROUTERS = ['lnf.routers.ReplicaRouter']
+# Seconds a client reads from the primary after its last write, to cover replication lag
+LNF_REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# LNF_CACHE_BACKEND picks the backend: 'locmem' (default, per process), 'file'
+# or 'redis'. Use a shared one (file or redis) when running several workers,
+# otherwise cached item lists are only invalidated in the worker that made the change.
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'lnf'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),  # requires the redis package
+}
+_cache_backend, _cache_location = CACHE_BACKENDS[os.environ.get('LNF_CACHE_BACKEND', 'locmem')]
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': _cache_backend,
+        'LOCATION': os.environ.get('LNF_CACHE_LOCATION', _cache_location),
     }
 }
 
+# Seconds a cached anonymous item list response is kept
+LNF_ITEMS_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,6 +227,25 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 
+# collectstatic prunes the vendored libraries, hashes the file names and
+# precompresses them; CompressedStaticFilesMiddleware serves the result with
+# immutable caching (see lnf/staticfiles.py). Brotli copies need the Brotli package.
+STATICFILES_FINDERS = [
+    'lnf.staticfiles.PrunedFileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+]
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'lnf.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+
+# The only files of the vendored libraries in static/ that are collected: the
+# ones the templates link to. Source maps and the RTL, ESM and unminified builds stay out.
+LNF_STATIC_VENDOR_FILES = {
+    'bootstrap': ['bootstrap/css/bootstrap.min.css', 'bootstrap/js/bootstrap.bundle.min.js'],
+    'fontawesome': ['fontawesome/css/all.min.css', 'fontawesome/webfonts/*.woff2'],
+}
 
 
 
@@ -142,6 +257,46 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Limits enforced while item images are uploaded, see lnf/uploadhandlers.py
+LNF_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+LNF_UPLOAD_MAX_PIXELS = 50_000_000
+# Lower cap for formats that are decoded at full size before downscaling (all but JPEG)
+LNF_UPLOAD_MAX_DECODED_PIXELS = 16_000_000
+LNF_UPLOAD_MAX_DIMENSION = 2560
+
+# Emails to watchers when an item's status changes, see lnf/notifications.py.
+# To try them locally, run an SMTP stand-in such as
+# `python -m aiosmtpd -n -l localhost:1025` and set LNF_NOTIFY_EMAIL=1.
+LNF_NOTIFY_EMAIL = os.environ.get('LNF_NOTIFY_EMAIL') == '1'
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 1025))
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'lost-and-found@localhost')
+
+# Request metrics, see lnf/metrics.py: a Server-Timing header for staff (or
+# everyone, with LNF_SERVER_TIMING_PUBLIC), one JSON line per request on the
+# 'lnf.metrics' logger and per-endpoint histograms at /metrics/ for staff.
+LNF_METRICS_WINDOW = 1000
+LNF_METRICS_SLOW_QUERIES = 3
+LNF_SLOW_REQUEST_MS = 500
+LNF_SERVER_TIMING_PUBLIC = os.environ.get('LNF_SERVER_TIMING_PUBLIC') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Only requests slower than LNF_SLOW_REQUEST_MS are logged by default;
+        # set LNF_METRICS_LOG_LEVEL=INFO to log every request
+        'lnf.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('LNF_METRICS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 LOGIN_URL = 'lnf:login'
 LOGIN_REDIRECT_URL = 'lnf:index'
 LOGOUT_REDIRECT_URL = 'lnf:index'